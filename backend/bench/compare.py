@@ -0,0 +1,49 @@
+"""
+Diff two benchmark result files written with --out.
+
+    python -m bench.compare before.json after.json [--threshold 5]
+
+Prints every numeric result present in both files with its relative change,
+marking changes larger than the threshold (percent).
+"""
+import argparse
+import json
+
+
+def flatten(node, prefix=""):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    old = dict(flatten(before["results"]))
+    new = dict(flatten(after["results"]))
+
+    print(f"{before.get('benchmark')}: {before.get('revision')} -> {after.get('revision')}")
+    width = max((len(k) for k in old.keys() & new.keys()), default=0)
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        change = (b - a) / a * 100 if a else 0.0
+        mark = " *" if abs(change) >= args.threshold else ""
+        print(f"{key:<{width}}  {a:>12g}  {b:>12g}  {change:+7.1f}%{mark}")
+    for key in sorted(old.keys() - new.keys()):
+        print(f"{key:<{width}}  removed")
+    for key in sorted(new.keys() - old.keys()):
+        print(f"{key:<{width}}  added")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Local stand-ins for every external service the backend talks to.
+
+- One threaded HTTP server that speaks just enough of the Bedrock runtime
+  (`/model/<id>/invoke`), Finnhub (`/api/v1/stock/...`), Alpaca news
+  (`/v1beta1/news`) and Gemini (`/v1beta/models/<id>:generateContent`) APIs.
+  Responses are deterministic, and embeddings are hashed bag-of-words vectors,
+  so similar texts get similar vectors. The Gemini endpoint answers with a
+  fixed text and rejects requests over its concurrency limit with a 429, like
+  a provider enforcing a quota.
+- Scripted pydantic-ai FunctionModels for the collect, search, writer and
+  router agents, with configurable latency.
+
+Call `configure_env()` before importing anything from `src` so the lazily
+created clients pick up the local endpoints.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+N_DIM = 256
+
+WORDS = (
+    "revenue earnings guidance margin growth demand supply chip datacenter cloud ai "
+    "shares stock price analyst upgrade downgrade target quarter fiscal outlook "
+    "investors market rally selloff volatility dividend buyback acquisition merger "
+    "regulators lawsuit settlement product launch customers orders backlog forecast "
+    "profit loss cost inflation rates federal reserve consumer spending inventory"
+).split()
+
+
+def _tokens(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def fake_vector(text: str) -> list[float]:
+    """Hashed bag-of-words embedding, L2-normalized."""
+    vec = [0.0] * N_DIM
+    for tok in _tokens(text):
+        h = zlib.crc32(tok.encode())
+        vec[h % N_DIM] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _external_id(ticker: str, i: int) -> int:
+    return (zlib.crc32(ticker.encode()) % 100_000) * 1000 + i
+
+
+def fake_news(ticker: str, n: int = 20, paragraphs: tuple[int, int] = (3, 8), now: datetime | None = None) -> list[dict]:
+    """Deterministic Alpaca-style news items for `ticker`."""
+    rng = random.Random(ticker)
+    now = now or datetime.now(timezone.utc)
+    items = []
+    for i in range(n):
+        topic = rng.sample(WORDS, 4)
+        body = []
+        for _ in range(rng.randint(*paragraphs)):
+            sentences = []
+            for _ in range(rng.randint(3, 6)):
+                words = rng.sample(WORDS, 10) + [ticker.lower(), f"{rng.uniform(1, 99):.1f}%"]
+                rng.shuffle(words)
+                sentences.append(" ".join(topic[:2] + words).capitalize() + ".")
+            body.append("<p>" + " ".join(sentences) + "</p>")
+        created = now - timedelta(hours=rng.uniform(0, 60))
+        items.append({
+            "id": _external_id(ticker, i),
+            "headline": f"{ticker} {' '.join(topic)} update {i}",
+            "author": "Bench Wire",
+            "source": "benchwire",
+            "created_at": created.isoformat().replace("+00:00", "Z"),
+            "updated_at": created.isoformat().replace("+00:00", "Z"),
+            "summary": f"{ticker} {topic[0]} and {topic[1]} news.",
+            "content": "".join(body),
+            "url": f"https://news.example.com/{ticker.lower()}/{i}",
+            "images": [
+                {"size": "large", "url": f"https://img.example.com/{ticker.lower()}/{i}-large.jpg"},
+                {"size": "small", "url": f"https://img.example.com/{ticker.lower()}/{i}-small.jpg"},
+                {"size": "thumb", "url": f"https://img.example.com/{ticker.lower()}/{i}-thumb.jpg"},
+            ],
+            "symbols": [ticker] + (["SPY"] if i % 5 == 0 else []),
+        })
+    return items
+
+
+def fake_stock_data(ticker: str) -> dict:
+    """Finnhub responses keyed by route suffix."""
+    return {
+        "stock/profile2": {
+            "name": f"{ticker} Corp", "ticker": ticker, "country": "US", "exchange": "NASDAQ",
+            "finnhubIndustry": "Technology", "ipo": "1999-01-22", "logo": "", "weburl": "https://example.com",
+        },
+        "stock/recommendation": [
+            {"symbol": ticker, "period": f"2025-{m:02d}-01", "strongBuy": 10 + m, "buy": 20, "hold": 8, "sell": 1, "strongSell": 0}
+            for m in range(6, 0, -1)
+        ],
+        "stock/earnings": [
+            {"symbol": ticker, "period": f"2025-{3 * q:02d}-30", "actual": 1.0 + q / 10, "estimate": 1.0, "surprise": q / 10,
+             "surprisePercent": q * 10.0, "quarter": q, "year": 2025}
+            for q in range(4, 0, -1)
+        ],
+        "stock/insider-sentiment": {
+            "symbol": ticker,
+            "data": [{"symbol": ticker, "year": 2025, "month": m, "change": -100 * m, "mspr": -5.0 * m} for m in range(1, 4)],
+        },
+    }
+
+
+class FakeServices(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency: dict | None = None,
+        news_per_ticker: int = 20,
+        gemini_concurrency: int = 0,
+        gemini_tokens: int = 50,
+        gemini_token_delay: float = 0.0,
+        gemini_prefill_rate: float = 0.0,
+    ):
+        super().__init__(address, _Handler)
+        # seconds of artificial latency per route: "bedrock", "finnhub", "alpaca", "gemini"
+        self.latency = latency or {}
+        self.news_per_ticker = news_per_ticker
+        # Gemini requests allowed in flight before answering 429, 0 for no limit
+        self.gemini_concurrency = gemini_concurrency
+        self.gemini_tokens = gemini_tokens
+        self.gemini_token_delay = gemini_token_delay
+        # prompt tokens processed per second before the first token, 0 for instant
+        self.gemini_prefill_rate = gemini_prefill_rate
+        self.gemini_active = 0
+        self.counts = {"bedrock": 0, "finnhub": 0, "alpaca": 0, "gemini": 0, "gemini_429": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def hit(self, route: str):
+        with self._lock:
+            self.counts[route] += 1
+        if self.latency.get(route):
+            time.sleep(self.latency[route])
+
+    def gemini_enter(self) -> bool:
+        """Take a Gemini slot, False when the limit is reached."""
+        with self._lock:
+            self.counts["gemini"] += 1
+            if self.gemini_concurrency and self.gemini_active >= self.gemini_concurrency:
+                self.counts["gemini_429"] += 1
+                return False
+            self.gemini_active += 1
+            return True
+
+    def gemini_exit(self):
+        with self._lock:
+            self.gemini_active -= 1
+
+    def start(self) -> "FakeServices":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeServices
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if parsed.path.startswith("/model/") and parsed.path.endswith("/invoke"):
+            self.server.hit("bedrock")
+            text = body.get("inputText", "")
+            return self._send({"embedding": fake_vector(text), "inputTextTokenCount": len(_tokens(text))})
+        match = re.fullmatch(r"/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)", parsed.path)
+        if match:
+            return self._gemini(match.group(1), body, stream=match.group(2) == "streamGenerateContent")
+        self._send({"message": "not found"}, 404)
+
+    def _gemini(self, model: str, body: dict, stream: bool):
+        server = self.server
+        if not server.gemini_enter():
+            return self._send(
+                {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}}, 429
+            )
+        try:
+            if server.latency.get("gemini"):
+                time.sleep(server.latency["gemini"])
+            texts = [p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", [])]
+            texts += [p.get("text", "") for p in (body.get("systemInstruction") or {}).get("parts", [])]
+            prompt = sum(len(t) for t in texts) // 4  # ~4 characters per token
+            if server.gemini_prefill_rate:
+                time.sleep(prompt / server.gemini_prefill_rate)
+
+            def chunk(text: str, output_tokens: int, done: bool) -> dict:
+                candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+                if done:
+                    candidate["finishReason"] = "STOP"
+                return {
+                    "candidates": [candidate],
+                    "usageMetadata": {
+                        "promptTokenCount": prompt,
+                        "candidatesTokenCount": output_tokens,
+                        "totalTokenCount": prompt + output_tokens,
+                    },
+                    "modelVersion": model,
+                }
+
+            if not stream:
+                return self._send(chunk("answer " * server.gemini_tokens, server.gemini_tokens, True))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for i in range(server.gemini_tokens):
+                if server.gemini_token_delay:
+                    time.sleep(server.gemini_token_delay)
+                done = i == server.gemini_tokens - 1
+                self.wfile.write(f"data: {json.dumps(chunk(f'tok{i} ', i + 1, done))}\r\n\r\n".encode())
+                self.wfile.flush()
+        except ConnectionError:
+            pass  # the client stopped reading the stream
+        finally:
+            server.gemini_exit()
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if parsed.path.startswith("/api/v1/"):
+            self.server.hit("finnhub")
+            route = parsed.path[len("/api/v1/"):].lstrip("/")  # the client joins with an extra slash
+            data = fake_stock_data(query.get("symbol", "").upper())
+            if route in data:
+                return self._send(data[route])
+        elif parsed.path == "/v1beta1/news":
+            self.server.hit("alpaca")
+            news = []
+            for sym in query.get("symbols", "").split(","):
+                news.extend(fake_news(sym.upper(), self.server.news_per_ticker))
+            limit = int(query.get("limit", 50))
+            return self._send({"news": news[:limit], "next_page_token": None})
+        self._send({"message": "not found"}, 404)
+
+
+def configure_env(services_url: str, db_url: str):
+    """Point every client in `src` at the fakes. Must run before `src` is imported."""
+    os.environ.update({
+        "DB_URL": db_url,
+        "BEDROCK_ENDPOINT_URL": services_url,
+        "FINNHUB_API_URL": f"{services_url}/api/v1",
+        "ALPACA_NEWS_URL": f"{services_url}/v1beta1/news",
+        "AWS_ACCESS_KEY": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "FINN_HUB": "bench",
+        "ALPACA_KEY": "bench",
+        "ALPACA_SECRET": "bench",
+        "GEMINI_API_KEY": "bench",
+        "GOOGLE_GEMINI_BASE_URL": services_url,
+        "PRELOAD_AGENT": "0",
+    })
+
+
+##############################################
+## Scripted models ##
+##############################################
+
+TICKER_RE = re.compile(r"\b[A-Z]{2,5}\b")
+
+
+def _user_prompt(messages) -> str:
+    from pydantic_ai.messages import ModelRequest, UserPromptPart
+
+    for m in messages:
+        if isinstance(m, ModelRequest):
+            for p in m.parts:
+                if isinstance(p, UserPromptPart) and isinstance(p.content, str):
+                    return p.content
+    return ""
+
+
+def _tool_returns(messages) -> list:
+    from pydantic_ai.messages import ModelRequest, ToolReturnPart
+
+    return [p for m in messages if isinstance(m, ModelRequest) for p in m.parts if isinstance(p, ToolReturnPart)]
+
+
+def scripted_models(llm_delay: float = 0.0, ttft_delay: float = 0.0, token_delay: float = 0.0, answer_tokens: int = 200):
+    """FunctionModels standing in for Gemini: one per agent in src.agent.workers.
+
+    The collect model calls collect_data for every upper-case ticker in the
+    prompt, the search model calls search_articles and search_snippets with the
+    prompt and returns what they found, and the writer streams `answer_tokens`
+    tokens. `llm_delay` is added to every non-streamed call, `ttft_delay` before
+    the first streamed token and `token_delay` between streamed tokens.
+    """
+    from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+    from pydantic_ai.models.function import FunctionModel
+
+    async def collect(messages, info):
+        await asyncio.sleep(llm_delay)
+        if _tool_returns(messages):
+            return ModelResponse(parts=[TextPart("done")])
+        tickers = sorted(set(TICKER_RE.findall(_user_prompt(messages))))
+        return ModelResponse(parts=[ToolCallPart("collect_data", {"ticker": t}) for t in tickers] or [TextPart("done")])
+
+    async def search(messages, info):
+        await asyncio.sleep(llm_delay)
+        returns = _tool_returns(messages)
+        if returns:
+            return ModelResponse(parts=[TextPart("\n".join(str(r.content) for r in returns) or "none")])
+        query = _user_prompt(messages)
+        return ModelResponse(parts=[
+            ToolCallPart("search_articles", {"query": query}),
+            ToolCallPart("search_snippets", {"query": f"{query} earnings guidance"}),
+        ])
+
+    async def write(messages, info):
+        await asyncio.sleep(llm_delay)
+        return ModelResponse(parts=[TextPart("answer " * answer_tokens)])
+
+    async def write_stream(messages, info):
+        await asyncio.sleep(ttft_delay)
+        for i in range(answer_tokens):
+            if token_delay:
+                await asyncio.sleep(token_delay)
+            yield f"tok{i} "
+
+    async def route(messages, info):
+        await asyncio.sleep(llm_delay)
+        return ModelResponse(parts=[TextPart("true")])
+
+    return {
+        "collect_agent": FunctionModel(collect),
+        "search_agent": FunctionModel(search),
+        "writer_agent": FunctionModel(write, stream_function=write_stream),
+        "router": FunctionModel(route),
+    }
+
+
+@contextmanager
+def override_agents(models: dict):
+    """
+    Swap the Gemini models of the agents in src.agent.workers for `models`. The
+    replacements keep the agent's priority and scheduler pool, so they are
+    scheduled like the real models.
+    """
+    from src.agent import workers
+    from src.agent.scheduler import ScheduledModel
+
+    with ExitStack() as stack:
+        for name, model in models.items():
+            agent = getattr(workers, name)
+            if isinstance(agent.model, ScheduledModel):
+                model = ScheduledModel(model, agent.model.priority, agent.model.pool)
+            stack.enter_context(agent.override(model=model))
+        yield
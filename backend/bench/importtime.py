@@ -0,0 +1,97 @@
+"""
+Import-time budget check based on `python -X importtime`.
+
+    python -m bench.importtime [--module src.app] [--repeat 5] [--budget-ms 400] [--top 15]
+
+Runs the import in fresh interpreters, reports the median cumulative time of
+the target module and the median self time per top-level package, and exits
+with status 1 if the budget is exceeded or if any package that should load
+lazily (see LAZY_PACKAGES) was imported eagerly.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Heavy dependencies that must only be imported on first use.
+LAZY_PACKAGES = ("langgraph", "pydantic_ai", "boto3", "botocore", "finnhub", "chonkie", "html2text", "requests")
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """Return (module, self_us, cumulative_us) rows from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run_once(module: str) -> list[tuple[str, int, int]]:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.splitlines()[-1] if out.stderr else "import failed")
+    return parse_importtime(out.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.app")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if the median cumulative import time exceeds this")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    totals = []
+    per_package = defaultdict(list)
+    imported = set()
+    for _ in range(args.repeat):
+        rows = run_once(args.module)
+        package_self = defaultdict(int)
+        for name, self_us, cumulative_us in rows:
+            package_self[name.split(".")[0]] += self_us
+            imported.add(name.split(".")[0])
+            if name == args.module:
+                totals.append(cumulative_us)
+        for package, us in package_self.items():
+            per_package[package].append(us)
+
+    total_ms = statistics.median(totals) / 1000
+    packages = sorted(
+        ((p, statistics.median(v) / 1000) for p, v in per_package.items()),
+        key=lambda x: x[1],
+        reverse=True,
+    )
+    eager = sorted(p for p in LAZY_PACKAGES if p in imported)
+
+    print(json.dumps({
+        "module": args.module,
+        "cumulative_ms": round(total_ms, 2),
+        "budget_ms": args.budget_ms,
+        "top_packages_ms": {p: round(ms, 2) for p, ms in packages[:args.top]},
+        "eager_heavy_imports": eager,
+    }, indent=2))
+
+    failed = False
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"FAIL: {args.module} imports in {total_ms:.1f}ms, budget is {args.budget_ms}ms", file=sys.stderr)
+        failed = True
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
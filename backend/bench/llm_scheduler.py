@@ -0,0 +1,179 @@
+"""
+Mixed LLM load against a rate-limited fake Gemini, with and without the scheduler.
+
+    python -m bench.llm_scheduler --provider-concurrency 4 --background 32 --interactive 8 --out llm.json
+
+The fake Gemini endpoint (bench/fakes.py) answers 429 RESOURCE_EXHAUSTED once more
+than `--provider-concurrency` requests are in flight, like a provider quota. A
+burst of background requests (collect/search/router) is started together with a
+steady trickle of interactive streams (the writer). Two setups go through the
+real GoogleModel and HTTP client:
+
+- `direct`: every request goes straight to the provider, no retries;
+- `scheduled`: requests go through src.agent.scheduler with `LLM_MAX_CONCURRENCY`
+  equal to the provider's limit, priorities and retries.
+
+Reports per priority: completed and failed calls, time to first token of the
+interactive streams, total latency, and the provider's 429 count and retries.
+No database is needed.
+
+It also cancels requests and streams while they are in flight, as a client
+disconnect cancels the graph, and exits with status 1 if that leaks scheduler
+slots (a later call on the pool then waits forever).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from . import fakes
+from .common import Timer, summarize, write_results
+
+MODEL = "google-gla:gemini-2.5-flash"
+
+
+async def run_setup(scheduled: bool, services: fakes.FakeServices, args) -> dict:
+    from pydantic_ai import Agent
+    from src.agent import scheduler
+    from src.agent.scheduler import Limits, LLMScheduler, Priority, ScheduledModel
+
+    pool = f"bench-{'scheduled' if scheduled else 'direct'}"
+    if scheduled:
+        scheduler._SCHEDULERS[pool] = LLMScheduler(pool, Limits(
+            max_concurrency=args.provider_concurrency,
+            retry_base_delay=args.retry_base_delay,
+        ))
+        background = Agent(ScheduledModel(MODEL, Priority.BACKGROUND, pool))
+        interactive = Agent(ScheduledModel(MODEL, Priority.INTERACTIVE, pool))
+    else:
+        background = interactive = Agent(MODEL)
+
+    services.counts.update(gemini=0, gemini_429=0)
+    samples = {"background": [], "interactive": [], "ttft": []}
+    failures = {"background": 0, "interactive": 0}
+
+    async def one_background(i: int):
+        started = time.perf_counter()
+        try:
+            await background.run(f"background task {i}: summarize the news")
+        except Exception:
+            failures["background"] += 1
+            return
+        samples["background"].append(time.perf_counter() - started)
+
+    async def one_interactive(i: int):
+        await asyncio.sleep(i * args.interactive_interval)
+        started = time.perf_counter()
+        first_token = None
+        try:
+            async with interactive.run_stream(f"user question {i}") as result:
+                async for _ in result.stream_text(delta=True):
+                    first_token = first_token or time.perf_counter() - started
+        except Exception:
+            failures["interactive"] += 1
+            return
+        samples["ttft"].append(first_token)
+        samples["interactive"].append(time.perf_counter() - started)
+
+    with Timer() as wall:
+        await asyncio.gather(
+            *(one_background(i) for i in range(args.background)),
+            *(one_interactive(i) for i in range(args.interactive)),
+        )
+    retries = scheduler.LLM_RETRIES.value(model=pool, reason="retried")
+    return {
+        "wall_seconds": round(wall.seconds, 3),
+        "provider_requests": services.counts["gemini"],
+        "provider_429": services.counts["gemini_429"],
+        "retries": retries,
+        "background": {"failed": failures["background"], "latency": summarize(samples["background"])},
+        "interactive": {
+            "failed": failures["interactive"],
+            "ttft": summarize(samples["ttft"]),
+            "latency": summarize(samples["interactive"]),
+        },
+    }
+
+
+async def check_cancellation(concurrency: int) -> dict:
+    """Cancel `concurrency` requests and as many streams mid-call, then check the pool still serves calls."""
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ModelResponse, TextPart
+    from pydantic_ai.models.function import FunctionModel
+    from src.agent import scheduler
+    from src.agent.scheduler import Limits, LLMScheduler, Priority, ScheduledModel
+
+    pool = "bench-cancel"
+    pool_scheduler = scheduler._SCHEDULERS[pool] = LLMScheduler(pool, Limits(max_concurrency=concurrency))
+    hang = asyncio.Event()
+
+    async def respond(messages, info):
+        if not hang.is_set():
+            await asyncio.Event().wait()
+        return ModelResponse(parts=[TextPart("ok")])
+
+    async def stream(messages, info):
+        if not hang.is_set():
+            await asyncio.Event().wait()
+        yield "ok"
+
+    agent = Agent(ScheduledModel(FunctionModel(respond, stream_function=stream), Priority.BACKGROUND, pool))
+
+    async def run_stream():
+        async with agent.run_stream("stream") as result:
+            await result.get_output()
+
+    tasks = [asyncio.create_task(agent.run("request")) for _ in range(concurrency)]
+    tasks += [asyncio.create_task(run_stream()) for _ in range(concurrency)]
+    await asyncio.sleep(0.1)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    leaked = pool_scheduler.in_flight
+    hang.set()
+    try:
+        await asyncio.wait_for(agent.run("after"), 5)
+        served = True
+    except asyncio.TimeoutError:
+        served = False
+    return {"leaked_slots": leaked, "served_after": served}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider-concurrency", type=int, default=4)
+    parser.add_argument("--background", type=int, default=32)
+    parser.add_argument("--interactive", type=int, default=8)
+    parser.add_argument("--interactive-interval", type=float, default=0.1, help="seconds between interactive streams")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Gemini latency before the response")
+    parser.add_argument("--tokens", type=int, default=20, help="tokens per response")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--retry-base-delay", type=float, default=0.2)
+    parser.add_argument("--setups", default="direct,scheduled")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    services = fakes.FakeServices(
+        latency={"gemini": args.latency},
+        gemini_concurrency=args.provider_concurrency,
+        gemini_tokens=args.tokens,
+        gemini_token_delay=args.token_delay,
+    ).start()
+    fakes.configure_env(services.url, os.getenv("BENCH_DB_URL", "postgresql+psycopg2://unused/unused"))
+
+    results = {
+        setup: asyncio.run(run_setup(setup == "scheduled", services, args))
+        for setup in args.setups.split(",")
+    }
+    services.shutdown()
+    results["cancellation"] = asyncio.run(check_cancellation(args.provider_concurrency))
+    write_results("llm_scheduler", vars(args), results, args.out)
+    cancellation = results["cancellation"]
+    if cancellation["leaked_slots"] or not cancellation["served_after"]:
+        print(f"cancelled calls leaked {cancellation['leaked_slots']} scheduler slots", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
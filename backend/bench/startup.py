@@ -0,0 +1,113 @@
+"""
+Startup benchmark: import cost per backend module and cold-start latency.
+
+    python -m bench.startup [--repeat 5] [--workers 1]
+
+Every measurement runs in a fresh interpreter so nothing is served from
+sys.modules. Import cost is cumulative (importing src.app also imports
+everything below it). Cold start is the time from spawning run.py until
+/livez answers.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from .common import free_port
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+MODULES = [
+    "src.rag.embed",
+    "src.models",
+    "src.db",
+    "src.scrape",
+    "src.rag.query",
+    "src.agent.workers",
+    "src.agent.graph",
+    "src.app",
+]
+
+IMPORT_SNIPPET = (
+    "import time, importlib; t = time.perf_counter(); "
+    "importlib.import_module({module!r}); print(time.perf_counter() - t)"
+)
+
+
+def import_seconds(module: str) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def interpreter_seconds() -> float:
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - t
+
+
+def cold_start_seconds(workers: int, timeout: float = 60.0) -> float:
+    port = free_port()
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port), WEB_CONCURRENCY=str(workers))
+    t = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "run.py"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - t < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/livez", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - t
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError("server did not become live in time")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 2),
+        "min_ms": round(min(samples) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--skip-server", action="store_true", help="only measure imports")
+    args = parser.parse_args()
+
+    results = {
+        "interpreter": summarize([interpreter_seconds() for _ in range(args.repeat)]),
+        "imports": {m: summarize([import_seconds(m) for _ in range(args.repeat)]) for m in MODULES},
+    }
+    if not args.skip_server:
+        results["cold_start"] = summarize([cold_start_seconds(args.workers) for _ in range(args.repeat)])
+        results["cold_start"]["workers"] = args.workers
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,23 @@
+import os
 import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "8000"))
+# Each worker is a separate process that imports the app and builds its own
+# clients and DB pool lazily, so nothing heavy is shared across processes.
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Compress websocket frames (permessage-deflate) for clients that offer it.
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "1") == "1"
 
 if __name__ == "__main__":
-    uvicorn.run("src.app:app", host="127.0.0.1", port=8000)
+    uvicorn.run(
+        "src.app:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE", "5")),
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+    )
@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 import datetime
 from .workers import SearchDataclass, search_agent, WriterDeps, writer_agent, RouterDeps, router, CollectData, collect_agent
 from langgraph.types import StreamWriter
+from .research_cache import cached_research
+from ..metrics import traced
+import logging
 
 from sqlalchemy.orm import Session
 # Import the message classes from Pydantic AI
@@ -15,31 +18,37 @@ if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
 load_dotenv()
-       
+logger = logging.getLogger(__name__)
+
 class SystemState(TypedDict):
     research_results: str
     query: str
+    tickers: list[str]
     iteration: int
 
+@traced("node.data_collector")
 async def data_collector(state: SystemState, writer:StreamWriter):
     writer({"update": "Finding out what data we need...", "done": False})
     deps = CollectData(writer = writer)
-    print(state['query'])
     await collect_agent.run(state['query'], deps = deps)
-    return
+    return {"tickers": sorted(set(deps.tickers))}
 
-    
+
+@traced("node.research")
 async def research(state: SystemState,  writer: StreamWriter):  
     writer({"update": "Thinking...", "done": False})
 
-    # Use the same dependency type as defined in the agent.
-    deps = SearchDataclass(writer=writer, max_results=5)
-    result =  await search_agent.run(state['query'], deps=deps) 
-    result = result.output.strip()
-    
+    async def run_search_agent(writer: StreamWriter) -> str:
+        # Use the same dependency type as defined in the agent.
+        deps = SearchDataclass(writer=writer, max_results=5)
+        result = await search_agent.run(state['query'], deps=deps)
+        return result.output.strip()
+
+    result = await cached_research(state['query'], state.get('tickers', []), writer, run_search_agent)
     return {"research_results": result}
 
 
+@traced("node.write")
 async def write(state: SystemState, writer: StreamWriter):
 
     deps = WriterDeps(query=state["query"] )
@@ -49,7 +58,7 @@ async def write(state: SystemState, writer: StreamWriter):
     else:
         prompt= f"USER_QUERY: {state["query"]}\n\nRESEARCH: {state["research_results"]}"
 
-    print(f"PROMPT:{prompt}")
+    logger.debug("writer prompt: %d chars", len(prompt))
     text = ""
     async with writer_agent.run_stream(prompt, deps=deps) as s:
         async for tok in s.stream_text(debounce_by=None):
@@ -115,7 +124,7 @@ async def run_agent(user_input:str):
     }
 
     async for msg in agent_flow.astream(
-        {"query": user_input, "iteration": 0}, 
+        {"query": user_input, "tickers": [], "iteration": 0}, 
         config, 
         stream_mode = "custom"   
     ):  
@@ -0,0 +1,146 @@
+"""
+Semantic cache in front of the research node.
+
+A research result is stored with the embedding of the question, the tickers the
+collect agent found in it and the id of the newest article of those tickers. A
+later question about exactly the same tickers whose embedding is within
+RESEARCH_CACHE_SIMILARITY reuses the result, as long as no article of those
+tickers was ingested since and the entry is younger than RESEARCH_CACHE_TTL. A hit
+replaces a whole search agent run (LLM calls and several KNN searches) with one
+embedding and two small queries.
+
+Entries are rows of research_cache, so all workers share them. Lookups scan the
+entries of one ticker set, which are few, so there's no vector index. Databases
+without the table (init-db not run since) skip the cache until the worker restarts.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import Optional
+
+from sqlalchemy import delete, func, select, text
+
+from ..db import get_db, get_engine
+from ..metrics import Counter
+from ..models import Article, ResearchCache, Ticker, ticker_article
+from ..rag.embed import get_embedding
+
+logger = logging.getLogger(__name__)
+
+# Seconds a research result can be reused, 0 disables the cache.
+RESEARCH_CACHE_TTL = float(os.getenv("RESEARCH_CACHE_TTL", "21600"))
+# Minimum cosine similarity between two questions to reuse the research.
+RESEARCH_CACHE_SIMILARITY = float(os.getenv("RESEARCH_CACHE_SIMILARITY", "0.9"))
+
+RESEARCH_CACHE_LOOKUPS = Counter("research_cache_lookups_total", "Research cache lookups by result", ("result",))
+RESEARCH_CACHE_SECONDS_SAVED = Counter(
+    "research_cache_seconds_saved_total", "Research time saved by cache hits, net of the lookup"
+)
+
+
+@cache
+def table_exists() -> bool:
+    """Whether the database has the research_cache table, checked once per worker."""
+    with get_engine().connect() as conn:
+        exists = conn.execute(text("SELECT to_regclass('research_cache') IS NOT NULL")).scalar()
+    if not exists:
+        logger.warning("research_cache table missing, the research cache is off (run init-db to create it)")
+    return exists
+
+
+def ticker_key(tickers) -> str:
+    return ",".join(sorted({t.upper() for t in tickers}))
+
+
+def latest_article_id(db, tickers) -> int:
+    """Id of the newest article about any of `tickers` (of any article without tickers), 0 if none."""
+    if tickers:
+        stmt = (
+            select(func.max(ticker_article.c.article_id))
+            .join(Ticker, Ticker.id == ticker_article.c.ticker_id)
+            .where(Ticker.ticker.in_([t.upper() for t in tickers]))
+        )
+    else:
+        stmt = select(func.max(Article.id))
+    return db.execute(stmt).scalar() or 0
+
+
+def lookup(vector: list[float], tickers) -> tuple[Optional[ResearchCache], int]:
+    """The closest fresh entry for `tickers` (or None) and the current latest_article_id."""
+    for db in get_db():
+        watermark = latest_article_id(db, tickers)
+        distance = ResearchCache.embedding.cosine_distance(vector)
+        entry = db.execute(
+            select(ResearchCache)
+            .where(
+                ResearchCache.tickers == ticker_key(tickers),
+                ResearchCache.created >= datetime.now(timezone.utc) - timedelta(seconds=RESEARCH_CACHE_TTL),
+                ResearchCache.last_article_id >= watermark,
+                distance <= 1 - RESEARCH_CACHE_SIMILARITY,
+            )
+            .order_by(distance)
+            .limit(1)
+        ).scalar_one_or_none()
+        if entry is not None:
+            db.expunge(entry)
+        return entry, watermark
+
+
+def store(query: str, vector: list[float], tickers, result: str, references: list[dict], watermark: int, seconds: float):
+    """Add an entry and drop the expired ones of the same tickers."""
+    now = datetime.now(timezone.utc)
+    key = ticker_key(tickers)
+    for db in get_db():
+        db.execute(delete(ResearchCache).where(
+            ResearchCache.tickers == key, ResearchCache.created < now - timedelta(seconds=RESEARCH_CACHE_TTL)
+        ))
+        db.add(ResearchCache(
+            tickers=key, query=query, embedding=vector, result=result, sources=references,
+            last_article_id=watermark, seconds=seconds, created=now,
+        ))
+
+
+async def cached_research(query: str, tickers, writer, research) -> str:
+    """
+    `await research(writer)`, or the result of an earlier research for a similar
+    question. Hits replay the references the original research emitted.
+    """
+    if RESEARCH_CACHE_TTL <= 0:
+        return await research(writer)
+    started = time.monotonic()
+    try:
+        enabled = await asyncio.to_thread(table_exists)
+        if enabled:
+            vector = await asyncio.to_thread(get_embedding, query)
+            entry, watermark = await asyncio.to_thread(lookup, vector, tickers)
+    except Exception:
+        logger.exception("research cache lookup failed")
+        return await research(writer)
+    if not enabled:
+        return await research(writer)
+    if entry is not None:
+        RESEARCH_CACHE_LOOKUPS.inc(result="hit")
+        RESEARCH_CACHE_SECONDS_SAVED.inc(max(entry.seconds - (time.monotonic() - started), 0.0))
+        logger.debug("research cache hit for %r: %r", entry.tickers, entry.query)
+        for reference in entry.sources:
+            writer(reference)
+        return entry.result
+    RESEARCH_CACHE_LOOKUPS.inc(result="miss")
+
+    references = []
+
+    def recording_writer(msg):
+        if "headline" in msg:
+            references.append(msg)
+        writer(msg)
+
+    started = time.monotonic()
+    result = await research(recording_writer)
+    try:
+        await asyncio.to_thread(store, query, vector, tickers, result, references, watermark, time.monotonic() - started)
+    except Exception:
+        logger.exception("storing research result failed")
+    return result
@@ -0,0 +1,331 @@
+"""
+Shared scheduler for every LLM call the agents make.
+
+All agents in workers.py use a ScheduledModel, which routes requests through the
+LLMScheduler of its model:
+
+- at most `max_concurrency` requests in flight, plus optional requests-per-minute
+  and tokens-per-minute budgets (token buckets, charged with an estimate up front
+  and corrected with the reported usage);
+- waiting requests are served by priority, so the writer's user-facing stream goes
+  ahead of collect/search/router calls;
+- transient failures (429, 5xx, transport errors) are retried with full-jitter
+  exponential backoff, limited per call and by a shared retry budget so an outage
+  doesn't multiply the load on the provider;
+- queue depth, in-flight requests, queue wait, retries and outcomes are exported
+  through src.metrics.
+
+Limits apply per worker process. Configure them with the LLM_* variables below or
+per model with LLM_LIMITS='{"google-gla:gemini-2.5-flash": {"requests_per_minute": 60}}'.
+"""
+import asyncio
+import heapq
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
+from enum import IntEnum
+from functools import cached_property
+
+from pydantic_ai.models import Model, infer_model
+from pydantic_ai.profiles import DEFAULT_PROFILE, ModelProfile
+from pydantic_ai.models.wrapper import WrapperModel
+
+from ..metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "LLM requests waiting for a slot", ("model", "priority"))
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "LLM requests in flight", ("model",))
+LLM_QUEUE_WAIT = Histogram("llm_queue_wait_seconds", "Time LLM requests waited for a slot", ("model", "priority"))
+LLM_REQUESTS = Counter("llm_requests_total", "LLM calls by final outcome", ("model", "priority", "outcome"))
+LLM_RETRIES = Counter("llm_retries_total", "LLM call retries", ("model", "reason"))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the provider", ("model",))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+CHARS_PER_TOKEN = 4
+# Profile function of each provider's models (what its Model gets from the provider),
+# importable without the provider's SDK.
+PROVIDER_PROFILES = {
+    "google-gla": "pydantic_ai.profiles.google:google_model_profile",
+    "google-vertex": "pydantic_ai.profiles.google:google_model_profile",
+}
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # the writer's stream the user is watching
+    BACKGROUND = 1  # data collection, research, routing
+
+
+@dataclass(frozen=True)
+class Limits:
+    max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    requests_per_minute: float = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))  # 0: unlimited
+    tokens_per_minute: float = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 0: unlimited
+    max_attempts: int = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+    retry_base_delay: float = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+    retry_max_delay: float = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+    # retries allowed per first attempt, on top of a reserve of `retry_budget_min`
+    retry_budget_ratio: float = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+    retry_budget_min: float = 10.0
+
+
+def limits_for(model_name: str) -> Limits:
+    overrides = json.loads(os.getenv("LLM_LIMITS", "{}")).get(model_name, {})
+    return replace(Limits(), **overrides)
+
+
+@dataclass
+class TokenBucket:
+    """`per_minute` units refilled continuously, holding at most a minute's worth."""
+    per_minute: float
+    level: float = field(init=False)
+    updated: float = field(init=False, default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.level = self.per_minute
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken, 0 if now. Requests larger than the bucket wait for a full one."""
+        if not self.per_minute:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.per_minute) - self.level
+        return max(missing, 0.0) * 60 / self.per_minute
+
+    def take(self, amount: float):
+        if self.per_minute:
+            self._refill()
+            self.level -= amount
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    import httpx
+
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class LLMScheduler:
+    def __init__(self, name: str, limits: Limits | None = None):
+        self.name = name
+        self.limits = limits or limits_for(name)
+        self.in_flight = 0
+        self._waiters = []  # heap of (priority, seq, future, cost)
+        self._seq = itertools.count()
+        self._timer = None
+        self._requests = TokenBucket(self.limits.requests_per_minute)
+        self._tokens = TokenBucket(self.limits.tokens_per_minute)
+        self._retry_budget = self.limits.retry_budget_min
+
+    def _dispatch(self):
+        self._timer = None
+        while self._waiters and self.in_flight < self.limits.max_concurrency:
+            priority, _, future, cost = self._waiters[0]
+            if future.done():  # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            delay = max(self._requests.wait_time(1), self._tokens.wait_time(cost))
+            if delay > 0:
+                # the head of the queue waits for budget, nobody overtakes it
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._requests.take(1)
+            self._tokens.take(cost)
+            self.in_flight += 1
+            LLM_IN_FLIGHT.set(self.in_flight, model=self.name)
+            future.set_result(None)
+
+    async def acquire(self, priority: Priority, cost: float):
+        """Wait for a slot and the request/token budget for a call estimated at `cost` tokens."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), future, cost))
+        labels = {"model": self.name, "priority": priority.name.lower()}
+        LLM_QUEUE_DEPTH.inc(**labels)
+        started = time.monotonic()
+        try:
+            if self._timer is None:
+                self._dispatch()
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # granted just before the cancellation arrived
+            raise
+        finally:
+            LLM_QUEUE_DEPTH.dec(**labels)
+            LLM_QUEUE_WAIT.observe(time.monotonic() - started, **labels)
+
+    def release(self, estimated: float = 0, used: int | None = None):
+        """Free the slot; `used` tokens as reported by the provider correct the estimate."""
+        self.in_flight -= 1
+        LLM_IN_FLIGHT.set(self.in_flight, model=self.name)
+        if used:
+            LLM_TOKENS.inc(used, model=self.name)
+            self._tokens.take(used - estimated)
+        if self._timer is None:
+            self._dispatch()
+
+    def record_attempt(self, attempt: int):
+        if attempt == 0:
+            self._retry_budget = min(
+                self._retry_budget + self.limits.retry_budget_ratio,
+                self.limits.retry_budget_min + self.limits.retry_budget_ratio * 100,
+            )
+
+    def retry_delay(self, error: BaseException, attempt: int) -> float | None:
+        """Backoff before the next attempt after `error`, or None to give up."""
+        if not is_retryable(error):
+            return None
+        if attempt + 1 >= self.limits.max_attempts:
+            LLM_RETRIES.inc(model=self.name, reason="attempts_exhausted")
+            return None
+        if self._retry_budget < 1:
+            LLM_RETRIES.inc(model=self.name, reason="budget_exhausted")
+            return None
+        self._retry_budget -= 1
+        LLM_RETRIES.inc(model=self.name, reason="retried")
+        cap = min(self.limits.retry_max_delay, self.limits.retry_base_delay * 2 ** attempt)
+        return random.uniform(0, cap)
+
+
+_SCHEDULERS: dict[str, LLMScheduler] = {}
+
+
+def get_scheduler(name: str) -> LLMScheduler:
+    if name not in _SCHEDULERS:
+        _SCHEDULERS[name] = LLMScheduler(name)
+    return _SCHEDULERS[name]
+
+
+def estimate_tokens(messages) -> int:
+    return sum(len(str(getattr(part, "content", ""))) for m in messages for part in m.parts) // CHARS_PER_TOKEN + 1
+
+
+class ScheduledModel(WrapperModel):
+    """
+    A model whose requests go through the LLMScheduler named `pool` (by default the
+    model name). A model name is only resolved (provider client, credentials) when
+    it's first used, like an Agent with defer_model_check: its name, system and,
+    for providers in PROVIDER_PROFILES, its profile (which Agent reads when it's
+    created) are known without it.
+    """
+
+    def __init__(self, model: Model | str, priority: Priority = Priority.BACKGROUND, pool: str | None = None):
+        Model.__init__(self)
+        self._model = model
+        self.priority = priority
+        self.pool = pool or (model if isinstance(model, str) else model.model_name)
+
+    @cached_property
+    def wrapped(self) -> Model:
+        return infer_model(self._model)
+
+    def _deferred(self) -> tuple[str, str] | None:
+        """(provider, model name) of a model name that isn't resolved yet."""
+        if isinstance(self._model, str) and "wrapped" not in self.__dict__ and ":" in self._model:
+            provider, _, name = self._model.partition(":")
+            return provider, name
+        return None
+
+    @property
+    def model_name(self) -> str:
+        deferred = self._deferred()
+        return deferred[1] if deferred else self.wrapped.model_name
+
+    @property
+    def system(self) -> str:
+        deferred = self._deferred()
+        return deferred[0] if deferred else self.wrapped.system
+
+    @cached_property
+    def profile(self) -> ModelProfile:
+        deferred = self._deferred()
+        if deferred and deferred[0] in PROVIDER_PROFILES:
+            module, function = PROVIDER_PROFILES[deferred[0]].split(":")
+            return getattr(importlib.import_module(module), function)(deferred[1]) or DEFAULT_PROFILE
+        return self.wrapped.profile
+
+    @property
+    def scheduler(self) -> LLMScheduler:
+        return get_scheduler(self.pool)
+
+    def _finish(self, outcome: str):
+        LLM_REQUESTS.inc(model=self.pool, priority=self.priority.name.lower(), outcome=outcome)
+
+    async def request(self, messages, model_settings, model_request_parameters):
+        scheduler = self.scheduler
+        cost = estimate_tokens(messages)
+        for attempt in itertools.count():
+            await scheduler.acquire(self.priority, cost)
+            scheduler.record_attempt(attempt)
+            try:
+                response = await self.wrapped.request(messages, model_settings, model_request_parameters)
+            except asyncio.CancelledError:
+                scheduler.release(cost)
+                self._finish("cancelled")
+                raise
+            except Exception as e:
+                scheduler.release(cost)
+                delay = scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    self._finish("error")
+                    raise
+                logger.warning("LLM request to %s failed (%s), retrying in %.2fs", self.pool, e, delay)
+                await asyncio.sleep(delay)
+                continue
+            scheduler.release(cost, response.usage.total_tokens)
+            self._finish("ok")
+            return response
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters, run_context=None):
+        # Only opening the stream is retried, once tokens reach the user a failure is final.
+        scheduler = self.scheduler
+        cost = estimate_tokens(messages)
+        for attempt in itertools.count():
+            await scheduler.acquire(self.priority, cost)
+            scheduler.record_attempt(attempt)
+            stream_cm = self.wrapped.request_stream(messages, model_settings, model_request_parameters, run_context)
+            try:
+                stream = await stream_cm.__aenter__()
+                break
+            except asyncio.CancelledError:
+                scheduler.release(cost)
+                self._finish("cancelled")
+                raise
+            except Exception as e:
+                scheduler.release(cost)
+                delay = scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    self._finish("error")
+                    raise
+                logger.warning("LLM stream from %s failed to open (%s), retrying in %.2fs", self.pool, e, delay)
+                await asyncio.sleep(delay)
+
+        outcome = "error"
+        try:
+            yield stream
+            outcome = "ok"
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                outcome = "cancelled"
+            if not await stream_cm.__aexit__(type(e), e, e.__traceback__):
+                raise
+        else:
+            await stream_cm.__aexit__(None, None, None)
+        finally:
+            scheduler.release(cost, stream.usage().total_tokens)
+            self._finish(outcome)
@@ -1,9 +1,10 @@
 #from duckduckgo_search import DDGS
 #import wikipedia
 from pydantic_ai import Agent, RunContext
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pydantic import BaseModel, Field
-from ..rag.query import get_similar 
+from ..rag.query import get_diverse, get_similar_many
+from ..rag.context import build_context
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session, selectinload
 from langgraph.types import StreamWriter
@@ -12,15 +13,30 @@ from ..db import get_db
 from ..scrape import get_stock_data, fetch_ticker_news
 from sqlalchemy import select
 from ..models import Ticker, Article, update_ticker, add_articles_batch
+from ..fundamentals import upsert_fundamentals, get_fundamentals, format_fundamentals
 from datetime import datetime, timezone, timedelta
+from ..metrics import traced
+from .scheduler import Priority, ScheduledModel
+import asyncio
+import logging
+import os
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Estimated tokens of retrieved text a single search tool call may return.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Article search results carry the article's digest instead of its full text, which read_article returns.
+ARTICLE_DIGESTS = os.getenv("ARTICLE_DIGESTS", "1") == "1"
 
 @dataclass
 class CollectData:
     writer: StreamWriter
+    # tickers collect_data was called with
+    tickers: list[str] = field(default_factory=list)
 
 collect_agent = Agent(
-    'google-gla:gemini-2.5-flash',
+    ScheduledModel('google-gla:gemini-2.5-flash', Priority.BACKGROUND),
+    defer_model_check=True,
     deps_type=CollectData,
     system_prompt=(
         """"
@@ -31,8 +47,10 @@ collect_agent = Agent(
 )
 
 @collect_agent.tool
+@traced("tool.collect_data")
 async def collect_data(search_data: RunContext[CollectData], ticker: str):
     # check if ticker in db
+    search_data.deps.tickers.append(ticker)
     for db in get_db():
         writer = search_data.deps.writer
         writer({"update": f"Collecting data about {ticker}", "done": False})
@@ -42,7 +60,7 @@ async def collect_data(search_data: RunContext[CollectData], ticker: str):
             .options(selectinload(Ticker.articles))
         )
         ticker_obj = result.scalars().one_or_none()
-        print("TICKER OBJECT:", ticker_obj)
+        logger.debug("ticker %s in db: %s", ticker, ticker_obj is not None)
 
         # Refresh ticker if missing or outdated (older than 10 days)
         now = datetime.now(timezone.utc)
@@ -59,15 +77,15 @@ async def collect_data(search_data: RunContext[CollectData], ticker: str):
                 ticker_obj = update_ticker(ticker, data, ticker_obj)
 
             ticker_obj.last_updated = now
+            upsert_fundamentals(db, ticker_obj.id, data)
 
         # News update condition: if last_updated_news is missing or >1 day old
         if (not ticker_obj.last_updated_news) or (ticker_obj.last_updated_news < now - timedelta(days=1)):
-            print("Fetching news...")
             writer({"update": f"Fetching news about {ticker}", "done": False})
 
             three_days_ago = (now - timedelta(days=3)).isoformat()
             news = await fetch_ticker_news(ticker, limit=50, published_from=three_days_ago)
-            print("Fetched news:", news)
+            logger.debug("fetched %d news items for %s", len(news), ticker)
             if news:
                 ticker_obj.last_updated_news = now
                 # Build map of existing articles by external_id
@@ -88,8 +106,6 @@ async def collect_data(search_data: RunContext[CollectData], ticker: str):
                 for article in articles_to_delete.values():
                     db.delete(article)
 
-        print("after the news part")
-
         # Commit transaction
         db.commit()
         # Refresh ticker_obj, especially with new relationship data
@@ -107,7 +123,8 @@ class SearchDataclass:
 
 # Create the agent with improved instructions in the system prompt.
 search_agent = Agent(
-    'google-gla:gemini-2.5-flash',
+    ScheduledModel('google-gla:gemini-2.5-flash', Priority.BACKGROUND),
+    defer_model_check=True,
     deps_type=SearchDataclass,
     system_prompt=(
         """"
@@ -127,14 +144,29 @@ search_agent = Agent(
         and goal.
 
         2. You are given access to a function search_articles that takes a query and returns the articles that had a relevant segment of text to this query. This funtion should 
-        be used for more general queries like "What are the latest trends in the stock market?" that way you receive the full article and not just snippets. 
+        be used for more general queries like "What are the latest trends in the stock market?" that way you receive a digest of each article (its key points, figures and sentiment) and not just snippets. 
 
         3. Your are given access to a function search_snippets that takes a query adn returns the snippets or articles that most closley relate to the query. This function should
         be user for more specific queries like "Latest Nvidia earning report reported revenue margin".
 
-        4. You can only use one of the functions once for each query you pass to it, and the query you pass to each function must be different. Queries to search_articles should be more general as they will return full article content,
+        4. You can only use one of the functions once for each query you pass to it, and the query you pass to each function must be different. Queries to search_articles should be more general as they will return article digests,
         but queries you pass to search_snippets should be more specific as they will return snippets or excerpts from articles. YOU CAN ONLY DO 3 FUNCTION CALLS PER RESEARCH REQUEST.
 
+        4b. PREFER the function search_many: plan all of your queries up front and pass them together as a list (at most 3). It runs every search at once and returns
+        the snippets grouped by query without duplicates. Set full_articles to true to get article digests instead of snippets. One search_many call counts as one function call.
+
+        4c. Every search function takes an optional ticker (e.g. "NVDA"). When all of your queries are about one company, pass its ticker to only search news
+        that mentions it; leave it out for market-wide or multi-company questions.
+
+        4d. Every search function also takes an optional days (e.g. 1 or 7). When the user asks about recent events ("today", "this week", "latest"), pass it
+        to only search news published in the last that many days. Results are already ranked with a preference for newer news.
+
+        4e. Call ticker_fundamentals with the tickers the user asks about to get analyst consensus, earnings surprises and insider sentiment.
+        It does not count towards the 3 function calls.
+
+        4f. Article digests come with an article id. Only when a digest leaves out details the user asked for, call read_article with that id to get
+        the full text. Call it at most twice; it does not count towards the 3 function calls.
+
         5. Your queries you pass into these functions will be used to execute a KNN search. Please format and if possible generalize the queries to retrieve the most valuable information to answer the user query.
 
         6. Always follow the specific output format for research bullets where each research segment is trailed with its link in parenthesis and then a 'backslash n' for a new line for every new 
@@ -156,40 +188,117 @@ def add_reasoner_output(ctx: RunContext[str]):
     """
     return f""" Todays date is {datetime.now(timezone.utc).strftime("%Y-%m-%d")} """
 
+def emit_reference(writer: StreamWriter, article: Article):
+    writer({"update": article.url, "headline": article.headline, "pic": article.images, "id": article.id, "done": False})
+
+def format_date(ts: datetime | None) -> str:
+    return ts.strftime("%Y-%m-%d %H:%M UTC") if ts else "unknown"
+
+def format_article(article: Article, full: bool = not ARTICLE_DIGESTS) -> str:
+    if full or not article.digest:
+        return f"Reference: [{article.headline}]({article.url}),\nDate: {format_date(article.created)}, Text: {article.content})\n"
+    return f"Reference: [{article.headline}]({article.url}),\nArticle id: {article.id}, Date: {format_date(article.created)}\n{article.digest}\n"
+
+def format_snippet(e) -> str:
+    return f"Reference: [{e.article.headline}]({e.article.url}),\nDate: {format_date(e.article.created)}\nSnippet: {e.article.content[e.start_ind:e.end_ind]}\n"
+
+def since_days(days: int | None) -> datetime | None:
+    return datetime.now(timezone.utc) - timedelta(days=days) if days else None
+
+def pack(writer: StreamWriter, entries: list[tuple[Article, str]]) -> str:
+    """Fit (article, text) entries into CONTEXT_TOKEN_BUDGET, emitting a reference for each article that made it in."""
+    sections = build_context([text for _, text in entries], CONTEXT_TOKEN_BUDGET)
+    seen = set()
+    for (article, _), _ in zip(entries, sections):
+        if article.id not in seen:
+            emit_reference(writer, article)
+            seen.add(article.id)
+    return "".join(sections)
+
 @search_agent.tool
-async def search_articles(search_data: RunContext[SearchDataclass], query: str, threshold: float = 0.4):
-    print("searching using: ", threshold, query)
+@traced("tool.search_articles")
+async def search_articles(
+    search_data: RunContext[SearchDataclass], query: str, threshold: float = 0.4,
+    ticker: str | None = None, days: int | None = None,
+):
+    logger.debug("search_articles: %s (%s)", query, ticker)
     writer = search_data.deps.writer
     writer({"update": f"Searching articles... '{query}'", "done": False})
    
     for db in get_db():  
-        snippets = get_similar(query, db, 20, .6)
-        article_ids = {s.article_id : s for s in snippets}
-        res = ""
-
-        for _, e in list(article_ids.items())[:5]:
-            writer({"update": e.article.url, "headline": e.article.headline, "pic": e.article.images, "id": e.article.id, "done": False})
-            res += f"Reference: [{e.article.headline}]({e.article.url}),\nDate: {e.article.created}, Text: {e.article.content})\n"
-        print("search results: ", res)
-        return res
+        snippets = get_diverse(query, db, 5, .6, candidates=20, per_article=1, ticker=ticker and ticker.upper(), since=since_days(days))
+        return pack(writer, [(e.article, format_article(e.article)) for e in snippets])
 
 @search_agent.tool
-async def search_snippets(search_data: RunContext[SearchDataclass], query: str, threshold: float = 0.4):
-    print("searching using: ", threshold, query)
+@traced("tool.search_snippets")
+async def search_snippets(
+    search_data: RunContext[SearchDataclass], query: str, threshold: float = 0.4,
+    ticker: str | None = None, days: int | None = None,
+):
+    logger.debug("search_snippets: %s (%s)", query, ticker)
 
     writer = search_data.deps.writer
     writer({"update": f"Searching... '{query}'", "done": False})
 
     for db in get_db():  
-        snippets = get_similar(query, db, 5, .6)
-        
-        res = ""
+        snippets = get_diverse(query, db, 5, .6, candidates=20, per_article=2, ticker=ticker and ticker.upper(), since=since_days(days))
+        return pack(writer, [(e.article, format_snippet(e)) for e in snippets])
 
-        for e in snippets:
-            writer({"update": e.article.url, "headline": e.article.headline, "pic": e.article.images, "id": e.article.id, "done": False})
-            res += f"Reference: [{e.article.headline}]({e.article.url}),\nDate: {e.article.created}\nSnippet: {e.article.content[e.start_ind:e.end_ind]}\n"
-        print("search results: ", res)
-        return res
+@search_agent.tool
+@traced("tool.search_many")
+async def search_many(
+    search_data: RunContext[SearchDataclass], queries: list[str], full_articles: bool = False,
+    ticker: str | None = None, days: int | None = None,
+):
+    logger.debug("search_many: %s (%s)", queries, ticker)
+    queries = queries[:3]
+
+    writer = search_data.deps.writer
+    writer({"update": "Searching... " + ", ".join(f"'{q}'" for q in queries), "done": False})
+
+    for db in get_db():
+        per_query = await asyncio.to_thread(
+            get_similar_many, queries, db, 5, .6,
+            candidates=20, per_article=1 if full_articles else 2,
+            ticker=ticker and ticker.upper(), since=since_days(days),
+        )
+
+        entries = []
+        seen_articles = set()
+        for query, snippets in per_query.items():
+            for e in snippets:
+                if full_articles:
+                    # one entry per article, across all queries
+                    if e.article_id in seen_articles:
+                        continue
+                    seen_articles.add(e.article_id)
+                    text = format_article(e.article)
+                else:
+                    text = format_snippet(e)
+                entries.append((e.article, f"Query: {query}\n{text}"))
+        return pack(writer, entries)
+
+@search_agent.tool
+@traced("tool.read_article")
+async def read_article(search_data: RunContext[SearchDataclass], article_id: int):
+    logger.debug("read_article: %s", article_id)
+    writer = search_data.deps.writer
+
+    for db in get_db():
+        article = db.get(Article, article_id)
+        if article is None:
+            return "No article with this id."
+        writer({"update": f"Reading '{article.headline}'", "done": False})
+        return pack(writer, [(article, format_article(article, full=True))])
+
+@search_agent.tool
+@traced("tool.ticker_fundamentals")
+async def ticker_fundamentals(search_data: RunContext[SearchDataclass], tickers: list[str]):
+    logger.debug("ticker_fundamentals: %s", tickers)
+    search_data.deps.writer({"update": "Reading fundamentals of " + ", ".join(tickers), "done": False})
+
+    for db in get_db():
+        return format_fundamentals(get_fundamentals(db, tickers[:5]))
 
     
 ##############################################
@@ -202,7 +311,8 @@ class WriterDeps:
     query: str = ""
 
 writer_agent = Agent(
-    'google-gla:gemini-2.5-flash',
+    ScheduledModel('google-gla:gemini-2.5-flash', Priority.INTERACTIVE),
+    defer_model_check=True,
     deps_type=WriterDeps,
     system_prompt=(
         """
@@ -264,7 +374,8 @@ class RouterResult(BaseModel):
 
 
 router = Agent(
-    'google-gla:gemini-2.5-pro-exp-03-25',
+    ScheduledModel('google-gla:gemini-2.5-pro-exp-03-25', Priority.BACKGROUND),
+    defer_model_check=True,
     deps_type = RouterDeps,
     system_prompt= 
     """ 
@@ -1,15 +1,43 @@
 from fastapi import FastAPI, Depends, WebSocket, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import json, requests, os
+import asyncio, importlib, logging, os
 
-from .db import get_db
-from .agent.graph import run_agent
+from .db import get_db, ping
+from . import chat_protocol, metrics
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 FRONT_URL = os.getenv("FRONT_URL", "*")
+REQUIRED_ENV = ("DB_URL", "AWS_ACCESS_KEY", "AWS_SECRET_ACCESS_KEY", "FINN_HUB", "ALPACA_KEY", "ALPACA_SECRET")
+# Alternatives, one of each must be set: the Gemini key pydantic_ai's google provider reads.
+REQUIRED_ENV_ANY = (("GOOGLE_API_KEY", "GEMINI_API_KEY"),)
+# Import the agent graph (langgraph, pydantic_ai, ...) in the background once the
+# server is up instead of at import time, so /livez answers immediately.
+PRELOAD_AGENT = os.getenv("PRELOAD_AGENT", "1") == "1"
 
-app = FastAPI()
+def load_agent():
+    return importlib.import_module(".agent.graph", __package__)
+
+agent_loader: asyncio.Task | None = None
+
+async def get_agent():
+    """The agent graph module, without blocking the event loop on its import."""
+    if agent_loader is not None:
+        # shielded: a chat that disconnects mid-wait mustn't cancel the preload
+        return await asyncio.shield(agent_loader)
+    return await asyncio.to_thread(load_agent)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global agent_loader
+    if PRELOAD_AGENT:
+        agent_loader = asyncio.create_task(asyncio.to_thread(load_agent))
+    yield
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[FRONT_URL],
@@ -20,30 +48,27 @@ app.add_middleware(
 
 @app.websocket("/chat")
 async def chat(websocket: WebSocket, db=Depends(get_db)):
+    stream = chat_protocol.negotiate(websocket.scope.get("subprotocols"))
     try:
-        await websocket.accept()
-        data = await websocket.receive_text()
-        parsed = json.loads(data)
-        query = parsed.get("query", "")
-        response_text = ""
-
-        async for message in run_agent(query):
-            if not message.get("done"):
-                await websocket.send_text(json.dumps(message))
-            else:
-                await websocket.send_text(json.dumps({"done": True}))
+        await websocket.accept(subprotocol=stream.subprotocol)
+        query = chat_protocol.parse_query(await websocket.receive())
+
+        agent = await get_agent()
+        with metrics.span("chat"):
+            if await stream.send_all(websocket, agent.run_agent(query)):
                 await websocket.close()
-                return
     except Exception as e:
-        print("Error in websocket:", e)
+        logger.exception("Error in websocket")
         try:
-            await websocket.send_text(json.dumps({"error": str(e), "done": True}))
+            await stream.send(websocket, {"error": str(e), "done": True})
             await websocket.close()
         except Exception:
             pass
 
 @app.get("/ticker-list")
 async def ticker_list():
+    import requests
+
     url = "https://www.sec.gov/files/company_tickers.json"
     headers = {
         "User-Agent": "Bob (bob@example.com)",
@@ -57,3 +82,28 @@ async def ticker_list():
         return resp.json()
     except ValueError:
         raise HTTPException(status_code=500, detail="Invalid JSON from SEC server")
+
+@app.get("/livez")
+async def livez():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    missing = [name for name in REQUIRED_ENV if not os.getenv(name)]
+    missing += [" or ".join(names) for names in REQUIRED_ENV_ANY if not any(map(os.getenv, names))]
+    if missing:
+        return JSONResponse({"status": "unavailable", "missing_env": missing}, status_code=503)
+    if agent_loader is not None:
+        if not agent_loader.done():
+            return JSONResponse({"status": "starting"}, status_code=503)
+        if agent_loader.exception():
+            return JSONResponse({"status": "unavailable", "agent": str(agent_loader.exception())}, status_code=503)
+    try:
+        await asyncio.to_thread(ping)
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "database": str(e)}, status_code=503)
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,159 @@
+"""
+Wire formats of the /chat websocket.
+
+The default is the original protocol: every run_agent message as a JSON text
+frame, `response` carrying the whole answer so far with every token.
+
+Clients that offer the `chat.msgpack.v1` subprotocol get the compact one instead.
+Every frame is a binary MessagePack map with the same keys, except:
+
+- `done` is left out unless it's true.
+- An article's reference (`update`, `headline`, `pic`, `id`) is sent once per
+  chat; later references to it are `{"ref": id}`.
+- Tokens are batched into `{"delta": text}`, text to append to the answer. The
+  first token goes out right away, then at most one frame per WS_TOKEN_BATCH_MS
+  (pending tokens are also flushed before any other message). Should the answer
+  ever be rewritten rather than extended, the frame is `{"response": text}`
+  with the whole answer, as in the JSON protocol.
+
+The client's query may be a JSON text frame or a MessagePack binary frame in
+either protocol. permessage-deflate is negotiated by the server (see run.py)
+with any client that offers it, whichever protocol is used.
+"""
+import asyncio
+import json
+import os
+
+import ormsgpack
+from fastapi import WebSocketDisconnect
+
+from .metrics import Counter
+
+COMPACT_SUBPROTOCOL = "chat.msgpack.v1"
+# Minimum milliseconds between two token frames of the compact protocol, 0 sends every token.
+WS_TOKEN_BATCH_MS = float(os.getenv("WS_TOKEN_BATCH_MS", "50"))
+
+CHAT_FRAMES = Counter("chat_frames_total", "Websocket frames sent by /chat", ("protocol",))
+CHAT_PAYLOAD_BYTES = Counter(
+    "chat_payload_bytes_total", "Websocket payload bytes sent by /chat, before permessage-deflate", ("protocol",)
+)
+
+
+def negotiate(subprotocols) -> "JSONStream":
+    """The stream for the subprotocols the client offered."""
+    if COMPACT_SUBPROTOCOL in (subprotocols or ()):
+        return CompactStream()
+    return JSONStream()
+
+
+def parse_query(message: dict) -> str:
+    """The query in the client's first message (as returned by `websocket.receive()`)."""
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        parsed = ormsgpack.unpackb(message["bytes"])
+    else:
+        parsed = json.loads(message.get("text") or "{}")
+    return parsed.get("query", "")
+
+
+class JSONStream:
+    """The original protocol."""
+    protocol = "json"
+    subprotocol = None
+
+    async def send(self, websocket, message: dict):
+        data = json.dumps(message)
+        await websocket.send_text(data)
+        CHAT_FRAMES.inc(protocol=self.protocol)
+        CHAT_PAYLOAD_BYTES.inc(len(data), protocol=self.protocol)  # ensure_ascii, so chars are bytes
+
+    async def send_all(self, websocket, messages) -> bool:
+        """Send run_agent's messages, True if it finished with a done message."""
+        async for message in messages:
+            if message.get("done"):
+                await self.send(websocket, {"done": True})
+                return True
+            await self.send(websocket, message)
+        return False
+
+
+class CompactStream(JSONStream):
+    """MessagePack frames, references sent once, batched token deltas."""
+    protocol = "msgpack"
+    subprotocol = COMPACT_SUBPROTOCOL
+
+    def __init__(self, batch_ms: float = WS_TOKEN_BATCH_MS):
+        self.interval = batch_ms / 1000
+        self.references = set()
+        self.answer = ""  # the answer as the client has it
+        self.pending = None  # newer answer not sent yet
+        self.flushed = float("-inf")
+
+    def compact(self, message: dict) -> dict:
+        message = {k: v for k, v in message.items() if k != "done" or v}
+        if "headline" in message and message.get("id") is not None:
+            if message["id"] in self.references:
+                return {"ref": message["id"]}
+            self.references.add(message["id"])
+        return message
+
+    async def send(self, websocket, message: dict):
+        data = ormsgpack.packb(self.compact(message))
+        await websocket.send_bytes(data)
+        CHAT_FRAMES.inc(protocol=self.protocol)
+        CHAT_PAYLOAD_BYTES.inc(len(data), protocol=self.protocol)
+
+    async def flush(self, websocket):
+        if self.pending is None:
+            return
+        answer, self.pending = self.pending, None
+        self.flushed = asyncio.get_running_loop().time()
+        if answer.startswith(self.answer):
+            message = {"delta": answer[len(self.answer):]}
+        else:
+            message = {"response": answer}
+        self.answer = answer
+        await self.send(websocket, message)
+
+    async def send_all(self, websocket, messages) -> bool:
+        # run_agent is drained by its own task, so pending tokens can be flushed
+        # on time while it's waiting for the next one
+        queue = asyncio.Queue()
+        end = object()
+
+        async def produce():
+            try:
+                async for message in messages:
+                    queue.put_nowait(message)
+            finally:
+                queue.put_nowait(end)
+
+        producer = asyncio.create_task(produce())
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if self.pending is None:
+                    message = await queue.get()
+                else:
+                    try:
+                        message = await asyncio.wait_for(queue.get(), max(self.flushed + self.interval - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        await self.flush(websocket)
+                        continue
+                if message is end:
+                    await producer  # raises what run_agent raised
+                    await self.flush(websocket)
+                    return False
+                if "response" in message and not message.get("done"):
+                    self.pending = message["response"]
+                    if loop.time() - self.flushed >= self.interval:
+                        await self.flush(websocket)
+                    continue
+                await self.flush(websocket)
+                if message.get("done"):
+                    await self.send(websocket, {"done": True})
+                    return True
+                await self.send(websocket, message)
+        finally:
+            producer.cancel()
@@ -1,35 +1,54 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, MetaData, Table, Column, UniqueConstraint, ForeignKeyConstraint, Index
 from sqlalchemy.orm import sessionmaker
-from .models import Base  
+from functools import cache
+from datetime import datetime, timezone, timedelta
+from .models import Base, N_DIM, EMBEDDING_STORAGE, Article, Embedding, Ticker, ticker_article
 import logging
+import re
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
-DB_URL = os.environ["DB_URL"]
-SQLALCHEMY_DATABASE_URL = (
-    DB_URL
-)
+# Pool sizing is per worker process; total connections = workers * (size + overflow).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# SQL statement logging, off by default since it sits on every query.
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+# New databases get article/embedding range-partitioned by month of `created`.
+ARTICLE_PARTITIONING = os.getenv("ARTICLE_PARTITIONING", "0") == "1"
+# Monthly partitions created ahead of time, so inserts never need DDL.
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+# Articles older than this are removed by the retention job, 0 keeps everything.
+ARTICLE_RETENTION_DAYS = int(os.getenv("ARTICLE_RETENTION_DAYS", "0"))
 
-# Create standard (synchronous) engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=True,
-    pool_pre_ping=True,
-    pool_recycle=1800, 
-    connect_args={},  
-)
+# The engine is created on first use so that every worker process opens its own
+# pool after it has been forked/spawned, and importing this module never needs DB_URL.
+@cache
+def get_engine():
+    return create_engine(
+        os.environ["DB_URL"],
+        echo=DB_ECHO,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        connect_args={},
+    )
 
 # Session factory
-SessionLocal = sessionmaker(
-    bind=engine,
-    autocommit=False,
-    autoflush=False,
-    expire_on_commit=False,
-)
+@cache
+def get_sessionmaker():
+    return sessionmaker(
+        bind=get_engine(),
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
 
 def get_db():
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
         db.commit()
@@ -39,27 +58,40 @@ def get_db():
     finally:
         db.close()
 
+def ping():
+    """Round trip to the database, raises if it is unreachable."""
+    with get_engine().connect() as conn:
+        conn.execute(text("SELECT 1"))
+
 # Create extensions (idempotent)
 def create_extensions():
-    with engine.connect() as conn:
+    with get_engine().connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
         conn.commit()
 
+# HNSW index name and indexed expression/opclass for each storage mode.
+# Queries must use the exact same expression for the planner to pick the index.
+EMBEDDING_INDEXES = {
+    "vector": ("indexing_vectors", "embedding vector_cosine_ops"),
+    "halfvec": ("embedding_halfvec_idx", f"(embedding::halfvec({N_DIM})) halfvec_cosine_ops"),
+    "bit": ("embedding_bit_idx", f"(binary_quantize(embedding)::bit({N_DIM})) bit_hamming_ops"),
+}
+
+def embedding_index_ddl(storage: str = EMBEDDING_STORAGE, concurrently: bool = False) -> str:
+    name, expression = EMBEDDING_INDEXES[storage]
+    return f"""
+        CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS {name}
+        ON embedding
+        USING hnsw ({expression})
+        WITH (m = 16, ef_construction = 64);
+    """
+
 # Create embedding indexes (idempotent)
-def create_embedding_index():
+def create_embedding_index(storage: str = EMBEDDING_STORAGE):
     try:
-        with engine.begin() as conn:
-            conn.execute(
-                text(
-                    """
-                    CREATE INDEX IF NOT EXISTS indexing_vectors
-                    ON embedding
-                    USING hnsw (embedding vector_cosine_ops)
-                    WITH (m = 16, ef_construction = 64);
-                    """
-                )
-            )
+        with get_engine().begin() as conn:
+            conn.execute(text(embedding_index_ddl(storage)))
             conn.execute(
                 text(
                     """
@@ -68,12 +100,356 @@ def create_embedding_index():
                     """
                 )
             )
+            # lets the planner answer selective ticker searches exactly instead of filtering an HNSW scan
+            conn.execute(text("CREATE INDEX IF NOT EXISTS embedding_symbols_idx ON embedding USING gin (symbols);"))
     except Exception as e:
         logging.exception("Error creating embedding indexes: %s", e)
 
 # Create all tables and indexes (idempotent)
-def create_all_tables():
+def create_all_tables(partitioned: bool = ARTICLE_PARTITIONING):
     # create tables
-    Base.metadata.create_all(bind=engine)
+    if partitioned:
+        Base.metadata.create_all(bind=get_engine(), tables=[
+            t for name, t in Base.metadata.tables.items() if name not in (*PARTITIONED_TABLES, "ticker_article")
+        ])
+        with get_engine().begin() as conn:
+            create_partitioned_tables(conn)
+    else:
+        Base.metadata.create_all(bind=get_engine())
     # create indexes
     create_embedding_index()
+
+##############################################
+## Partitioning ##
+##############################################
+
+# article and embedding are partitioned by `created`, each month's partition of
+# embedding holds the chunks of that month's articles (embedding.created is a copy
+# of the article's), so a month of news is removed by dropping two tables.
+PARTITIONED_TABLES = ("article", "embedding")
+PARTITION_RE = re.compile(r"^(article|embedding)_p(\d{4})_(\d{2})$")
+
+def month_start(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+
+def next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+def partitioned_metadata() -> MetaData:
+    """
+    The ORM tables adapted to partitioning: primary and unique keys must include the
+    partition key, so they become (id, created) and (external_id, created), embedding
+    references article by (article_id, created), and ticker_article loses its foreign
+    key to article. The ORM keeps mapping `id` alone, which the sequence keeps unique.
+    """
+    metadata = MetaData()
+    Ticker.__table__.to_metadata(metadata)
+
+    def columns(table):
+        return [
+            Column(
+                c.name, c.type,
+                primary_key=c.primary_key or c.name == "created",
+                nullable=c.nullable and c.name != "created",
+                autoincrement=c.name == "id",
+            )
+            for c in table.columns
+        ]
+
+    def indexes(table):
+        return [Index(i.name, *[c.name for c in i.columns]) for i in table.indexes]
+
+    Table(
+        "article", metadata, *columns(Article.__table__), *indexes(Article.__table__),
+        UniqueConstraint("external_id", "created"),
+        postgresql_partition_by="RANGE (created)",
+    )
+    Table(
+        "embedding", metadata, *columns(Embedding.__table__), *indexes(Embedding.__table__),
+        ForeignKeyConstraint(["article_id", "created"], ["article.id", "article.created"], ondelete="CASCADE"),
+        postgresql_partition_by="RANGE (created)",
+    )
+    Table(
+        "ticker_article", metadata,
+        Column("ticker_id", ticker_article.c.ticker_id.type, primary_key=True),
+        Column("article_id", ticker_article.c.article_id.type, primary_key=True),
+        ForeignKeyConstraint(["ticker_id"], ["ticker.id"]),
+    )
+    return metadata
+
+def create_partitioned_tables(conn, first: datetime | None = None, last: datetime | None = None):
+    metadata = partitioned_metadata()
+    metadata.create_all(bind=conn, tables=[metadata.tables[t] for t in (*PARTITIONED_TABLES, "ticker_article")])
+    default_first, default_last = partition_window()
+    create_partitions(conn, first or default_first, last or default_last)
+
+def partition_window(months_ahead: int = PARTITION_MONTHS_AHEAD) -> tuple[datetime, datetime]:
+    """
+    The dates monthly partitions are kept for: the retention period, and at least the
+    previous month (news is often published the month before it's fetched), up to
+    `months_ahead` months from now.
+    """
+    now = datetime.now(timezone.utc)
+    return now - timedelta(days=max(ARTICLE_RETENTION_DAYS, 31)), now + timedelta(days=31 * months_ahead)
+
+def is_partitioned(conn) -> bool:
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'article'")).scalar() == "p"
+
+def create_partitions(conn, first: datetime, last: datetime) -> list[str]:
+    """
+    Monthly partitions covering `first`..`last` plus a default partition for rows
+    outside of them. Rows of a new month that already sit in the default partition
+    are moved to the month's partitions.
+    """
+    created = []
+    for table in PARTITIONED_TABLES:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+    month = month_start(first)
+    while month <= last:
+        names = [partition_name(table, month) for table in PARTITIONED_TABLES]
+        try:
+            with conn.begin_nested():
+                moved = move_out_of_default(conn, month)
+                for table, name in zip(PARTITIONED_TABLES, names):
+                    conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+                    ))
+                for table in moved:
+                    conn.execute(text(f"INSERT INTO {table} SELECT * FROM moved_{table}"))
+                    conn.execute(text(f"DROP TABLE moved_{table}"))
+            created.extend(names)
+        except Exception as e:
+            logging.warning("Could not create partitions %s: %s", ", ".join(names), e)
+        month = next_month(month)
+    return created
+
+def move_out_of_default(conn, month: datetime) -> tuple[str, ...]:
+    """
+    Copy `month`'s rows of the default partitions into temporary moved_<table> tables
+    and delete them, so the month's partitions can be created. The tables moved.
+    """
+    bounds = {"start": month, "end": next_month(month)}
+    in_month = "created >= :start AND created < :end"
+    if not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM article_default WHERE {in_month})"), bounds).scalar():
+        return ()
+    for table in PARTITIONED_TABLES:
+        conn.execute(text(f"CREATE TEMP TABLE moved_{table} AS SELECT * FROM {table}_default WHERE {in_month}"), bounds)
+    # the embeddings first, they reference the articles
+    for table in reversed(PARTITIONED_TABLES):
+        conn.execute(text(f"DELETE FROM {table}_default WHERE {in_month}"), bounds)
+    return PARTITIONED_TABLES
+
+def list_partitions(conn, table: str) -> dict[str, datetime]:
+    """Monthly partitions of `table` by name, with the month they hold."""
+    rows = conn.execute(
+        text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:t AS regclass)"),
+        {"t": table},
+    ).scalars()
+    partitions = {}
+    for name in rows:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions[name] = datetime(int(match[2]), int(match[3]), 1, tzinfo=timezone.utc)
+    return partitions
+
+def apply_retention(days: int = ARTICLE_RETENTION_DAYS, months_ahead: int = PARTITION_MONTHS_AHEAD) -> dict:
+    """
+    Remove articles (and their embeddings and ticker links) published more than `days`
+    ago. Partitioned tables drop every month that ended before the cutoff and get
+    partitions for the previous month up to the coming `months_ahead` months, as well as
+    for every month kept that still has rows in the default partition; what is left
+    (expired rows of the default partition, the cutoff month or an unpartitioned table)
+    is removed with a DELETE.
+    """
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=days)
+    dropped = []
+    with get_engine().begin() as conn:
+        if is_partitioned(conn):
+            create_partitions(conn, now - timedelta(days=31), now + timedelta(days=31 * months_ahead))
+            stranded = conn.execute(
+                text(
+                    "SELECT DISTINCT date_trunc('month', created AT TIME ZONE 'UTC') FROM article_default "
+                    "WHERE :days <= 0 OR created >= :cutoff"
+                ),
+                {"days": days, "cutoff": cutoff},
+            ).scalars().all()
+            for month in sorted(stranded):
+                create_partitions(conn, month.replace(tzinfo=timezone.utc), month.replace(tzinfo=timezone.utc))
+            for name, month in sorted(list_partitions(conn, "article").items()):
+                if days <= 0 or next_month(month) > cutoff:
+                    continue
+                conn.execute(text(f"DELETE FROM ticker_article WHERE article_id IN (SELECT id FROM {name})"))
+                # the embedding partition first, it references the article partition
+                for table in ("embedding", "article"):
+                    partition = partition_name(table, month)
+                    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+                    conn.execute(text(f"DROP TABLE {partition}"))
+                    dropped.append(partition)
+        deleted = 0
+        if days > 0:
+            conn.execute(
+                text("DELETE FROM ticker_article ta USING article a WHERE ta.article_id = a.id AND a.created < :cutoff"),
+                {"cutoff": cutoff},
+            )
+            # embeddings go with their article through ON DELETE CASCADE
+            deleted = conn.execute(text("DELETE FROM article WHERE created < :cutoff"), {"cutoff": cutoff}).rowcount
+    return {"dropped_partitions": dropped, "deleted_articles": deleted}
+
+def migrate_to_partitioned():
+    """
+    Rebuild article and embedding as monthly partitioned tables: the old tables (and
+    their indexes) are renamed with an _unpartitioned suffix, rows are copied into
+    partitions covering their dates and the old tables are dropped, all in one
+    transaction. Run created-timestamps and article-digests first on databases
+    that predate them.
+    """
+    article_columns = [f'"{c.name}"' for c in Article.__table__.columns]
+    article_values = ["COALESCE(created, now())" if c == '"created"' else c for c in article_columns]
+    embedding_columns = [f'"{c.name}"' for c in Embedding.__table__.columns if c.name != "created"]
+    with get_engine().begin() as conn:
+        if is_partitioned(conn):
+            return
+        for table in ("embedding", "article"):
+            for name in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :t"), {"t": table}).scalars():
+                conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:48]}_unpartitioned"'))
+            conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned"))
+        conn.execute(text("ALTER TABLE ticker_article DROP CONSTRAINT IF EXISTS ticker_article_article_id_fkey"))
+
+        first, last = conn.execute(text("SELECT min(created), max(created) FROM article_unpartitioned")).one()
+        window_first, window_last = partition_window()
+        create_partitioned_tables(conn, min(first or window_first, window_first), max(last or window_last, window_last))
+
+        conn.execute(text(
+            f"INSERT INTO article ({', '.join(article_columns)}) "
+            f"SELECT {', '.join(article_values)} FROM article_unpartitioned"
+        ))
+        conn.execute(text(
+            f"INSERT INTO embedding ({', '.join(embedding_columns)}, created) "
+            f"SELECT {', '.join('e.' + c for c in embedding_columns)}, a.created "
+            f"FROM embedding_unpartitioned e JOIN article a ON a.id = e.article_id"
+        ))
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('article', 'id'), COALESCE((SELECT max(id) FROM article), 0) + 1, false)"))
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('embedding', 'id'), COALESCE((SELECT max(id) FROM embedding), 0) + 1, false)"))
+        conn.execute(text("DROP TABLE embedding_unpartitioned, article_unpartitioned"))
+    create_embedding_index()
+
+def migrate_created_timestamps():
+    """
+    Convert article.created from the ISO strings it used to hold to timestamptz and
+    backfill embedding.created from it. Idempotent; indexes are built concurrently.
+    """
+    with get_engine().begin() as conn:
+        column_type = conn.execute(text(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = 'article' AND column_name = 'created'"
+        )).scalar_one_or_none()
+        if column_type != "timestamp with time zone":
+            conn.execute(text(
+                "ALTER TABLE article ALTER COLUMN created TYPE timestamptz USING NULLIF(created, '')::timestamptz"
+            ))
+        conn.execute(text("ALTER TABLE embedding ADD COLUMN IF NOT EXISTS created timestamptz"))
+        conn.execute(text(
+            """
+            UPDATE embedding e SET created = a.created
+            FROM article a
+            WHERE e.article_id = a.id AND e.created IS DISTINCT FROM a.created
+            """
+        ))
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_article_created ON article (created)"))
+        conn.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_embedding_created ON embedding (created)"))
+
+def migrate_fundamentals():
+    """
+    Move the fundamentals from the old ticker ARRAY(JSON) columns into the
+    recommendation_trend, earnings_surprise and insider_sentiment tables, then drop
+    the columns. Idempotent.
+    """
+    Base.metadata.create_all(bind=get_engine(), tables=[
+        Base.metadata.tables[t] for t in ("recommendation_trend", "earnings_surprise", "insider_sentiment")
+    ])
+    with get_engine().begin() as conn:
+        columns = set(conn.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'ticker'"
+        )).scalars())
+        if "recommendation_trends" in columns:
+            conn.execute(text(
+                """
+                INSERT INTO recommendation_trend (ticker_id, period, strong_buy, buy, hold, sell, strong_sell)
+                SELECT DISTINCT ON (t.id, (r->>'period')::date) t.id, (r->>'period')::date,
+                    (r->>'strongBuy')::int, (r->>'buy')::int, (r->>'hold')::int, (r->>'sell')::int, (r->>'strongSell')::int
+                FROM ticker t, unnest(t.recommendation_trends) r
+                WHERE r->>'period' IS NOT NULL
+                ON CONFLICT DO NOTHING
+                """
+            ))
+        if "earnings_surprises" in columns:
+            conn.execute(text(
+                """
+                INSERT INTO earnings_surprise (ticker_id, period, year, quarter, actual, estimate, surprise, surprise_percent)
+                SELECT DISTINCT ON (t.id, (r->>'period')::date) t.id, (r->>'period')::date,
+                    (r->>'year')::int, (r->>'quarter')::int, (r->>'actual')::float, (r->>'estimate')::float,
+                    (r->>'surprise')::float, (r->>'surprisePercent')::float
+                FROM ticker t, unnest(t.earnings_surprises) r
+                WHERE r->>'period' IS NOT NULL
+                ON CONFLICT DO NOTHING
+                """
+            ))
+        if "insider_sentiment" in columns:
+            conn.execute(text(
+                """
+                INSERT INTO insider_sentiment (ticker_id, period, change, mspr)
+                SELECT DISTINCT ON (t.id, make_date((r->>'year')::int, (r->>'month')::int, 1))
+                    t.id, make_date((r->>'year')::int, (r->>'month')::int, 1), (r->>'change')::int, (r->>'mspr')::float
+                FROM ticker t, unnest(t.insider_sentiment) r
+                WHERE r->>'year' IS NOT NULL AND r->>'month' IS NOT NULL
+                ON CONFLICT DO NOTHING
+                """
+            ))
+        for column in ("recommendation_trends", "earnings_surprises", "insider_sentiment"):
+            conn.execute(text(f"ALTER TABLE ticker DROP COLUMN IF EXISTS {column}"))
+
+def migrate_article_digests(batch_size: int = 500) -> int:
+    """
+    Add article.digest and fill it for articles that don't have one yet, in batches
+    of `batch_size` committed separately. Idempotent; returns the number of digests written.
+    """
+    from .rag.digest import make_digest
+
+    with get_engine().begin() as conn:
+        conn.execute(text("ALTER TABLE article ADD COLUMN IF NOT EXISTS digest text"))
+    written, last_id = 0, 0
+    while True:
+        with get_engine().begin() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT id, headline, summary, content FROM article "
+                    "WHERE digest IS NULL AND id > :last ORDER BY id LIMIT :n"
+                ),
+                {"last": last_id, "n": batch_size},
+            ).all()
+            if not rows:
+                return written
+            conn.execute(
+                text("UPDATE article SET digest = :digest WHERE id = :id"),
+                [{"id": r.id, "digest": make_digest(r.content or "", r.headline or "", r.summary or "")} for r in rows],
+            )
+        written += len(rows)
+        last_id = rows[-1].id
+
+def migrate_embedding_storage(storage: str, drop_others: bool = True):
+    """
+    Switch the vector index to another storage mode without touching existing rows:
+    the new index is built concurrently from the full-precision column, then the
+    indexes of the other modes are dropped. Set EMBEDDING_STORAGE to match afterwards.
+    """
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(embedding_index_ddl(storage, concurrently=True)))
+        if drop_others:
+            for mode, (name, _) in EMBEDDING_INDEXES.items():
+                if mode != storage:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
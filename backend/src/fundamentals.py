@@ -0,0 +1,219 @@
+"""
+Finnhub fundamentals as time series: recommendation trends, earnings surprises and
+insider sentiment, one row per (ticker, period).
+
+Refreshes upsert rows and only write the ones whose values changed. Reads return
+small pre-aggregated summaries that fit in a prompt.
+"""
+import datetime
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from .models import EarningsSurprise, InsiderSentiment, RecommendationTrend, Ticker
+
+logger = logging.getLogger(__name__)
+
+# How many periods the summaries look at.
+RECOMMENDATION_MONTHS = 4
+EARNINGS_QUARTERS = 4
+INSIDER_MONTHS = 3
+
+
+def _date(value) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def recommendation_rows(items: List[dict]) -> List[dict]:
+    return [
+        {
+            "period": _date(r.get("period")),
+            "strong_buy": r.get("strongBuy"),
+            "buy": r.get("buy"),
+            "hold": r.get("hold"),
+            "sell": r.get("sell"),
+            "strong_sell": r.get("strongSell"),
+        }
+        for r in items or []
+        if _date(r.get("period"))
+    ]
+
+
+def earnings_rows(items: List[dict]) -> List[dict]:
+    return [
+        {
+            "period": _date(r.get("period")),
+            "year": r.get("year"),
+            "quarter": r.get("quarter"),
+            "actual": r.get("actual"),
+            "estimate": r.get("estimate"),
+            "surprise": r.get("surprise"),
+            "surprise_percent": r.get("surprisePercent"),
+        }
+        for r in items or []
+        if _date(r.get("period"))
+    ]
+
+
+def insider_rows(items: List[dict]) -> List[dict]:
+    return [
+        {
+            "period": datetime.date(r["year"], r["month"], 1),
+            "change": r.get("change"),
+            "mspr": r.get("mspr"),
+        }
+        for r in items or []
+        if r.get("year") and r.get("month")
+    ]
+
+
+def upsert_changed(session: Session, model, ticker_id: int, rows: List[dict]) -> int:
+    """
+    Insert new (ticker, period) rows and update existing ones whose values differ.
+    Unchanged rows are not written at all. Returns the number of rows written.
+    """
+    # the API can repeat a period, the last one wins
+    rows = list({r["period"]: {**r, "ticker_id": ticker_id} for r in rows}.values())
+    if not rows:
+        return 0
+    keys = [c.name for c in model.__table__.primary_key]
+    values = [c.name for c in model.__table__.columns if c.name not in keys]
+    stmt = insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={c: stmt.excluded[c] for c in values},
+        where=tuple_(*[model.__table__.c[c] for c in values]).is_distinct_from(
+            tuple_(*[stmt.excluded[c] for c in values])
+        ),
+    ).returning(model.period)
+    return len(session.execute(stmt).all())
+
+
+def upsert_fundamentals(session: Session, ticker_id: int, data: Dict[str, Any]) -> Dict[str, int]:
+    """Store the fundamentals of a get_stock_data() result, returns rows written per table."""
+    written = {
+        "recommendation_trend": upsert_changed(
+            session, RecommendationTrend, ticker_id, recommendation_rows(data.get("recommendation_trends"))
+        ),
+        "earnings_surprise": upsert_changed(
+            session, EarningsSurprise, ticker_id, earnings_rows(data.get("earnings_surprises"))
+        ),
+        "insider_sentiment": upsert_changed(
+            session, InsiderSentiment, ticker_id, insider_rows((data.get("insider_sentiment") or {}).get("data"))
+        ),
+    }
+    logger.debug("fundamentals written for ticker %s: %s", ticker_id, written)
+    return written
+
+
+def _latest(session: Session, model, symbols: List[str], periods: int) -> Dict[str, list]:
+    """The `periods` most recent rows of `model` per symbol, newest first."""
+    rank = func.row_number().over(partition_by=model.ticker_id, order_by=model.period.desc()).label("rank")
+    ranked = (
+        select(Ticker.ticker.label("symbol"), model, rank)
+        .join(Ticker, Ticker.id == model.ticker_id)
+        .where(Ticker.ticker.in_(symbols))
+        .subquery()
+    )
+    rows = session.execute(select(ranked).where(ranked.c.rank <= periods).order_by(ranked.c.symbol, ranked.c.period.desc()))
+    latest = {s: [] for s in symbols}
+    for row in rows.mappings():
+        latest[row["symbol"]].append(row)
+    return latest
+
+
+def _buy_share(r) -> Optional[float]:
+    counts = [r["strong_buy"] or 0, r["buy"] or 0, r["hold"] or 0, r["sell"] or 0, r["strong_sell"] or 0]
+    total = sum(counts)
+    return (counts[0] + counts[1]) / total if total else None
+
+
+def get_fundamentals(session: Session, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Compact per-ticker views: the latest analyst consensus and its buy share a few
+    months back, the recent EPS surprise trend and insider sentiment. Three queries
+    for any number of tickers.
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in symbols if s))
+    if not symbols:
+        return {}
+    recommendations = _latest(session, RecommendationTrend, symbols, RECOMMENDATION_MONTHS)
+    earnings = _latest(session, EarningsSurprise, symbols, EARNINGS_QUARTERS)
+    insiders = _latest(session, InsiderSentiment, symbols, INSIDER_MONTHS)
+
+    summaries = {}
+    for symbol in symbols:
+        summary = {}
+        recs = recommendations[symbol]
+        if recs:
+            latest = recs[0]
+            summary["consensus"] = {
+                "period": latest["period"].isoformat(),
+                "strong_buy": latest["strong_buy"], "buy": latest["buy"], "hold": latest["hold"],
+                "sell": latest["sell"], "strong_sell": latest["strong_sell"],
+                "buy_share": _buy_share(latest),
+                "buy_share_before": _buy_share(recs[-1]) if len(recs) > 1 else None,
+                "before_period": recs[-1]["period"].isoformat() if len(recs) > 1 else None,
+            }
+        quarters = earnings[symbol][::-1]  # oldest first
+        if quarters:
+            surprises = [q["surprise_percent"] for q in quarters if q["surprise_percent"] is not None]
+            summary["surprises"] = {
+                "quarters": [
+                    {"year": q["year"], "quarter": q["quarter"], "actual": q["actual"], "estimate": q["estimate"],
+                     "surprise_percent": q["surprise_percent"]}
+                    for q in quarters
+                ],
+                "beats": sum(1 for s in surprises if s > 0),
+                "mean_surprise_percent": sum(surprises) / len(surprises) if surprises else None,
+            }
+        months = insiders[symbol][::-1]
+        if months:
+            summary["insiders"] = {
+                "months": [{"period": m["period"].strftime("%Y-%m"), "mspr": m["mspr"], "change": m["change"]} for m in months],
+                "net_change": sum(m["change"] or 0 for m in months),
+            }
+        summaries[symbol] = summary
+    return summaries
+
+
+def _pct(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.0%}"
+
+
+def format_fundamentals(summaries: Dict[str, Dict[str, Any]]) -> str:
+    """A few lines per ticker for the prompt."""
+    lines = []
+    for symbol, s in summaries.items():
+        lines.append(f"{symbol} fundamentals:")
+        if not s:
+            lines.append("- no data")
+        if "consensus" in s:
+            c = s["consensus"]
+            line = (
+                f"- Analyst consensus ({c['period'][:7]}): {c['strong_buy']} strong buy, {c['buy']} buy, {c['hold']} hold, "
+                f"{c['sell']} sell, {c['strong_sell']} strong sell ({_pct(c['buy_share'])} buy)"
+            )
+            if c["before_period"]:
+                line += f", {_pct(c['buy_share_before'])} buy in {c['before_period'][:7]}"
+            lines.append(line)
+        if "surprises" in s:
+            e = s["surprises"]
+            quarters = ", ".join(
+                f"Q{q['quarter']} {q['year']} {q['actual']} vs {q['estimate']} ({q['surprise_percent']:+.1f}%)"
+                if q["surprise_percent"] is not None else f"Q{q['quarter']} {q['year']} n/a"
+                for q in e["quarters"]
+            )
+            mean = "n/a" if e["mean_surprise_percent"] is None else f"{e['mean_surprise_percent']:+.1f}%"
+            lines.append(f"- EPS actual vs estimate, oldest first: {quarters}; beat {e['beats']}/{len(e['quarters'])}, mean surprise {mean}")
+        if "insiders" in s:
+            i = s["insiders"]
+            months = ", ".join(f"{m['period']} MSPR {m['mspr']}" for m in i["months"])
+            lines.append(f"- Insider sentiment: {months}; net shares {i['net_change']:+d}")
+    return "\n".join(lines) + "\n" if lines else ""
@@ -0,0 +1,116 @@
+"""
+Database maintenance commands.
+
+    python -m src.maintenance init-db
+    python -m src.maintenance embedding-storage halfvec
+    python -m src.maintenance created-timestamps
+    python -m src.maintenance partition-storage
+    python -m src.maintenance fundamentals-tables
+    python -m src.maintenance article-digests
+    python -m src.maintenance retention --days 90
+    python -m src.maintenance export-snapshot snapshots/latest
+    python -m src.maintenance import-snapshot snapshots/latest
+"""
+import argparse
+
+from . import db
+from .models import EMBEDDING_STORAGE_MODES
+
+
+def init_db(args):
+    db.create_extensions()
+    db.create_all_tables(partitioned=args.partitioned)
+
+
+def embedding_storage(args):
+    db.migrate_embedding_storage(args.mode, drop_others=not args.keep_others)
+    print(f"Vector index now uses {args.mode!r}; set EMBEDDING_STORAGE={args.mode} for the app.")
+
+
+def created_timestamps(args):
+    db.migrate_created_timestamps()
+    print("article.created is timestamptz, embedding.created is backfilled and both are indexed.")
+
+
+def partition_storage(args):
+    db.migrate_to_partitioned()
+    print("article and embedding are partitioned by month; run `retention` daily to add and drop partitions.")
+
+
+def fundamentals_tables(args):
+    db.migrate_fundamentals()
+    print("Fundamentals moved to their own tables, the ticker JSON columns are dropped.")
+
+
+def article_digests(args):
+    written = db.migrate_article_digests()
+    print(f"Wrote {written} article digests.")
+
+
+def retention(args):
+    result = db.apply_retention(args.days, args.months_ahead)
+    print(f"Dropped {len(result['dropped_partitions'])} partitions, deleted {result['deleted_articles']} articles.")
+
+
+def export_snapshot(args):
+    from .snapshot import export_snapshot
+
+    rows = export_snapshot(args.path)
+    print("Exported " + ", ".join(f"{n} {t}" for t, n in rows.items()) + f" rows to {args.path}.")
+
+
+def import_snapshot(args):
+    from .snapshot import import_snapshot
+
+    stats = import_snapshot(args.path, args.workers, args.memory)
+    print(f"Loaded {sum(stats['rows'].values())} rows in {stats['load_seconds']}s, "
+          f"built {len(stats['indexes'])} indexes in {sum(stats['indexes'].values()):.1f}s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.maintenance")
+    commands = parser.add_subparsers(required=True)
+
+    p = commands.add_parser("init-db", help="create extensions, tables and indexes")
+    p.add_argument("--partitioned", action="store_true", default=db.ARTICLE_PARTITIONING,
+                   help="partition article/embedding by month (default: ARTICLE_PARTITIONING)")
+    p.set_defaults(func=init_db)
+
+    p = commands.add_parser("embedding-storage", help="rebuild the vector index for another storage mode")
+    p.add_argument("mode", choices=EMBEDDING_STORAGE_MODES)
+    p.add_argument("--keep-others", action="store_true", help="keep the indexes of the other modes")
+    p.set_defaults(func=embedding_storage)
+
+    p = commands.add_parser("created-timestamps", help="migrate article.created to timestamptz and backfill embedding.created")
+    p.set_defaults(func=created_timestamps)
+
+    p = commands.add_parser("partition-storage", help="convert article/embedding to monthly partitioned tables")
+    p.set_defaults(func=partition_storage)
+
+    p = commands.add_parser("fundamentals-tables", help="move ticker fundamentals from JSON columns to time-series tables")
+    p.set_defaults(func=fundamentals_tables)
+
+    p = commands.add_parser("article-digests", help="add article.digest and compute it for existing articles")
+    p.set_defaults(func=article_digests)
+
+    p = commands.add_parser("retention", help="drop expired news and create upcoming monthly partitions")
+    p.add_argument("--days", type=int, default=db.ARTICLE_RETENTION_DAYS, help="keep this many days of news, 0 keeps all")
+    p.add_argument("--months-ahead", type=int, default=db.PARTITION_MONTHS_AHEAD)
+    p.set_defaults(func=retention)
+
+    p = commands.add_parser("export-snapshot", help="write ticker, fundamentals, article and embedding tables to Parquet files")
+    p.add_argument("path", help="snapshot directory")
+    p.set_defaults(func=export_snapshot)
+
+    p = commands.add_parser("import-snapshot", help="bulk-load a snapshot into an empty database")
+    p.add_argument("path", help="snapshot directory")
+    p.add_argument("--workers", type=int, default=None, help="parallel maintenance workers per index build (default: INDEX_BUILD_WORKERS)")
+    p.add_argument("--memory", default=None, help="maintenance_work_mem for index builds (default: INDEX_BUILD_MEMORY)")
+    p.set_defaults(func=import_snapshot)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,50 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON, ARRAY, Text, Table
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, Float, ForeignKey, JSON, ARRAY, Text, Table
+from sqlalchemy import cast
+from sqlalchemy.dialects.postgresql import array as pg_array
 from sqlalchemy.orm import relationship, Session, selectinload
 from sqlalchemy.ext.declarative import declarative_base
 from pgvector.sqlalchemy import Vector
-import pgvector
 import datetime
-import html2text
+import os
 from typing import Optional, List, Dict, Any
 
 from .rag.embed import get_embedding, chunk_text  # these may still be async or sync — adapt accordingly
+from .rag.digest import make_digest
+from .metrics import traced
 
 Base = declarative_base()
 
 def clean_html(html: str) -> str:
+    import html2text
+
     h = html2text.HTML2Text()
     h.ignore_links = True
     h.ignore_images = True
     h.body_width = 0
     return h.handle(html or "").strip()
 
+def parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    """ISO 8601 string from the news API ("2025-01-02T03:04:05Z") to an aware datetime."""
+    if not value:
+        return None
+    try:
+        ts = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc)
+
 N_DIM = 256
 
+# How the HNSW index stores vectors. The embedding column always keeps full float32
+# precision; "halfvec" (float16) and "bit" (binary quantized) index an expression
+# over it and KNN results are re-ranked against the full vectors.
+EMBEDDING_STORAGE_MODES = ("vector", "halfvec", "bit")
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector")
+if EMBEDDING_STORAGE not in EMBEDDING_STORAGE_MODES:
+    raise ValueError(f"EMBEDDING_STORAGE must be one of {EMBEDDING_STORAGE_MODES}, got {EMBEDDING_STORAGE!r}")
+# Candidates fetched from a quantized index per requested result before re-ranking.
+EMBEDDING_RERANK_FACTOR = int(os.getenv("EMBEDDING_RERANK_FACTOR", "4"))
+
 ticker_article = Table(
     "ticker_article",
     Base.metadata,
@@ -41,9 +66,7 @@ class Ticker(Base):
     ipo = Column(String, nullable=True)
     company_url = Column(String, nullable=True)
 
-    recommendation_trends = Column(ARRAY(JSON), nullable=True)
-    earnings_surprises = Column(ARRAY(JSON), nullable=True)
-    insider_sentiment = Column(ARRAY(JSON), nullable=True)
+    # Finnhub fundamentals live in RecommendationTrend, EarningsSurprise and InsiderSentiment
 
     last_updated_news = Column(DateTime(timezone=True), nullable=True)
 
@@ -66,9 +89,6 @@ class Ticker(Base):
             "exchange": self.exchange,
             "ipo": self.ipo,
             "company_url": self.company_url,
-            "recommendation_trends": self.recommendation_trends,
-            "earnings_surprises": self.earnings_surprises,
-            "insider_sentiment": self.insider_sentiment,
             "last_updated_news": self.last_updated_news,
             "articles": [
                 {
@@ -95,12 +115,42 @@ def update_ticker(ticker_symbol: str, data: dict, obj: Optional[Ticker] = None)
     obj.ipo = profile.get("ipo")
     obj.company_url = profile.get("weburl")
 
-    obj.recommendation_trends = data.get("recommendation_trends")
-    obj.earnings_surprises = data.get("earnings_surprises")
-    obj.insider_sentiment = data.get("insider_sentiment", {}).get("data")
-
     return obj
 
+##############################################
+## Fundamentals ##
+##############################################
+
+# One row per (ticker, period), written with fundamentals.upsert_fundamentals.
+
+class RecommendationTrend(Base):
+    __tablename__ = "recommendation_trend"
+    ticker_id = Column(Integer, ForeignKey("ticker.id", ondelete="CASCADE"), primary_key=True)
+    period = Column(Date, primary_key=True)
+    strong_buy = Column(Integer, nullable=True)
+    buy = Column(Integer, nullable=True)
+    hold = Column(Integer, nullable=True)
+    sell = Column(Integer, nullable=True)
+    strong_sell = Column(Integer, nullable=True)
+
+class EarningsSurprise(Base):
+    __tablename__ = "earnings_surprise"
+    ticker_id = Column(Integer, ForeignKey("ticker.id", ondelete="CASCADE"), primary_key=True)
+    period = Column(Date, primary_key=True)
+    year = Column(Integer, nullable=True)
+    quarter = Column(Integer, nullable=True)
+    actual = Column(Float, nullable=True)
+    estimate = Column(Float, nullable=True)
+    surprise = Column(Float, nullable=True)
+    surprise_percent = Column(Float, nullable=True)
+
+class InsiderSentiment(Base):
+    __tablename__ = "insider_sentiment"
+    ticker_id = Column(Integer, ForeignKey("ticker.id", ondelete="CASCADE"), primary_key=True)
+    period = Column(Date, primary_key=True)  # first day of the month
+    change = Column(Integer, nullable=True)
+    mspr = Column(Float, nullable=True)
+
 def get_or_create_tickers(
     ticker_list: List[str], session: Session, existing_ticker: Optional[Ticker] = None
 ) -> Dict[str, Ticker]:
@@ -130,11 +180,13 @@ class Article(Base):
     author = Column(String, nullable=True)
     source = Column(String, nullable=True)
     url = Column(String, nullable=True)
-    created = Column(String, nullable=True)
+    created = Column(DateTime(timezone=True), nullable=True, index=True)
 
     headline = Column(String, nullable=True)
     summary = Column(Text, nullable=True)
     content = Column(Text, nullable=True)
+    # key points, figures and sentiment of content (rag.digest), what search tools return
+    digest = Column(Text, nullable=True)
     images = Column(ARRAY(JSON), nullable=True)
 
     tickers = relationship(
@@ -163,24 +215,29 @@ class Article(Base):
             "headline": self.headline,
             "summary": self.summary,
             "content": self.content,
+            "digest": self.digest,
             "images": self.images,
         }
 
 def create_article(data: dict) -> Article:
+    content = clean_html(data.get("content", ""))
     article = Article(
         external_id=data.get("id"),
         symbols=data.get("symbols", []),
         author=data.get("author"),
         source=data.get("source"),
         url=data.get("url"),
-        created=data.get("created_at"),
+        # the partition key when article is partitioned, so never left empty
+        created=parse_timestamp(data.get("created_at")) or datetime.datetime.now(datetime.timezone.utc),
         headline=data.get("headline"),
         summary=data.get("summary"),
-        content=clean_html(data.get("content", "")),
+        content=content,
+        digest=make_digest(content, data.get("headline") or "", data.get("summary") or ""),
         images=data.get("images", [])
     )
     return article
 
+@traced("ingest")
 def add_articles_batch(
     articles_data: List[dict], session: Session, ticker_obj: Ticker
 ) -> List[Article]:
@@ -214,6 +271,7 @@ def add_articles_batch(
                 embedding=embedding_vec,
                 article_id=article.id,
                 symbols=symbols,
+                created=article.created,
                 order=i,
                 start_ind=chunk.get("start", 0),
                 end_ind=chunk.get("end", len(text_piece)),
@@ -232,6 +290,25 @@ class Embedding(Base):
     start_ind = Column(Integer, nullable=False)
     end_ind = Column(Integer, nullable=False)
     embedding = Column(Vector(N_DIM), nullable=False)
+    # Copy of the article's publication time so KNN queries can filter by date without a join
+    created = Column(DateTime(timezone=True), nullable=True, index=True)
 
     article_id = Column(Integer, ForeignKey("article.id", ondelete="CASCADE"), nullable=False)
     article = relationship("Article", back_populates="embeddings", lazy="selectin")
+
+def mentions(embedding, ticker: str):
+    """`symbols @> ARRAY[ticker]` for Embedding (or an alias of it), which the GIN index on symbols serves."""
+    return embedding.symbols.op("@>")(cast(pg_array([ticker]), ARRAY(String)))
+
+class ResearchCache(Base):
+    """A research result, reused for similar questions about the same tickers (agent.research_cache)."""
+    __tablename__ = "research_cache"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tickers = Column(String, nullable=False, index=True)  # sorted and comma separated, "" for none
+    query = Column(Text, nullable=False)
+    embedding = Column(Vector(N_DIM), nullable=False)
+    result = Column(Text, nullable=False)
+    sources = Column(JSON, nullable=False)  # reference messages the research emitted
+    last_article_id = Column(Integer, nullable=False)  # newest article of the tickers at the time
+    seconds = Column(Float, nullable=False)  # how long the research took
+    created = Column(DateTime(timezone=True), nullable=False, index=True)
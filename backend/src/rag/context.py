@@ -0,0 +1,49 @@
+"""
+Token-budgeted packing of retrieved text into a prompt section.
+
+Token counts are estimated from characters (about 4 per token for English),
+which is close enough for budgeting and needs no tokenizer.
+"""
+CHARS_PER_TOKEN = 4
+MIN_SECTION_TOKENS = 40
+# appended to truncated sections, counted in their budget
+TRUNCATED = " …\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """Cut `text` to at most `max_chars` including the ellipsis, preferably at a sentence or line end."""
+    if len(text) <= max_chars:
+        return text
+    if max_chars < len(TRUNCATED):
+        return text[:max_chars]
+    cut = text[:max_chars - len(TRUNCATED)]
+    end = max(cut.rfind(". "), cut.rfind("\n"))
+    if end > len(cut) // 2:
+        cut = cut[:end + 1]
+    return cut.rstrip() + TRUNCATED
+
+
+def build_context(sections: list[str], token_budget: int) -> list[str]:
+    """
+    Fit `sections` (most relevant first) into `token_budget`. The budget is shared
+    fairly: short sections are kept whole and the rest is split evenly between the
+    longer ones, which are truncated. Trailing sections are dropped when their share
+    would fall below MIN_SECTION_TOKENS. Returns the first n sections, possibly truncated.
+    """
+    n = min(len(sections), max(token_budget // MIN_SECTION_TOKENS, 1))
+    sections = sections[:n]
+    budget = token_budget * CHARS_PER_TOKEN
+
+    # water-filling: hand out the budget smallest-first
+    limits = [0] * n
+    remaining = budget
+    for count, i in enumerate(sorted(range(n), key=lambda i: len(sections[i]))):
+        share = remaining // (n - count)
+        limits[i] = min(len(sections[i]), share)
+        remaining -= limits[i]
+
+    return [truncate(s, limit) for s, limit in zip(sections, limits)]
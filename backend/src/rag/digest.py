@@ -0,0 +1,99 @@
+"""
+Compact extractive digests of articles, computed at ingestion.
+
+A digest is the article's most informative sentences (headline overlap, figures,
+financial terms), the figures it mentions and a lexicon sentiment, in a few hundred
+characters. Search tools return digests instead of full bodies so the research
+string, and with it the writer's prompt, no longer grows with article length; the
+full text stays available through the read_article tool.
+
+No model is involved: a digest of a few thousand characters takes about a millisecond.
+"""
+import os
+import re
+
+# Sentences kept per digest.
+DIGEST_SENTENCES = int(os.getenv("DIGEST_SENTENCES", "3"))
+# Figures listed per digest.
+DIGEST_FIGURES = 6
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+WORD_RE = re.compile(r"[a-z][a-z']+")
+FIGURE_RE = re.compile(
+    r"(?:[$€£]\s?\d[\d,]*(?:\.\d+)?(?:\s?(?:billion|million|trillion|bn|[bmk])\b)?"
+    r"|\b\d[\d,]*(?:\.\d+)?\s?(?:%|percent\b|billion\b|million\b|trillion\b|bps\b|basis points\b)"
+    r"|\b(?:Q[1-4]|FY)\s?'?\d{2,4}\b)",
+    re.IGNORECASE,
+)
+
+FINANCE_TERMS = frozenset(
+    "revenue revenues earnings eps profit loss margin margins guidance forecast outlook sales growth "
+    "dividend buyback acquisition merger deal shares stock price target rating upgrade downgrade "
+    "analyst analysts quarter quarterly fiscal demand orders backlog layoffs lawsuit settlement".split()
+)
+POSITIVE = frozenset(
+    "beat beats surge surged soar soared jump jumped rally rallied gain gains gained rise rises rose "
+    "record strong stronger growth grew upgrade upgraded outperform bullish raise raised boost boosted "
+    "exceed exceeded exceeds profit profitable optimistic rebound rebounded expand expanded".split()
+)
+NEGATIVE = frozenset(
+    "miss missed misses fall fell falls drop dropped plunge plunged slump slumped decline declined "
+    "weak weaker loss losses downgrade downgraded underperform bearish cut cuts lower lowered "
+    "lawsuit probe layoffs warning warns warned recall concern concerns selloff slowdown".split()
+)
+STOPWORDS = frozenset("the a an and or of to in on for with at by from as is are was were its it that this".split())
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in SENTENCE_RE.split(" ".join(text.split())) if s.strip()]
+
+
+def figures(text: str, limit: int = DIGEST_FIGURES) -> list[str]:
+    """Distinct money amounts, percentages and fiscal periods, in order of appearance."""
+    found = dict.fromkeys(m.group(0).strip() for m in FIGURE_RE.finditer(text))
+    return list(found)[:limit]
+
+
+def sentiment(text: str) -> tuple[str, int]:
+    words = WORD_RE.findall(text.lower())
+    score = sum(w in POSITIVE for w in words) - sum(w in NEGATIVE for w in words)
+    label = "positive" if score >= 2 else "negative" if score <= -2 else "neutral"
+    return label, score
+
+
+def key_sentences(text: str, headline: str = "", n: int = DIGEST_SENTENCES) -> list[str]:
+    """The `n` highest scoring sentences, in their original order."""
+    sentences = split_sentences(text)
+    if len(sentences) <= n:
+        return sentences
+    topic = set(WORD_RE.findall(headline.lower())) - STOPWORDS
+    scored = []
+    for i, s in enumerate(sentences):
+        words = set(WORD_RE.findall(s.lower())) - STOPWORDS
+        score = (
+            2 * len(words & topic)
+            + 2 * len(FIGURE_RE.findall(s))
+            + len(words & FINANCE_TERMS)
+            + (1 if i == 0 else 0)  # news leads with the story
+            - (1 if len(s) > 400 else 0)
+        )
+        scored.append((score, -i, s))
+    top = sorted(scored, reverse=True)[:n]
+    return [s for _, _, s in sorted(top, key=lambda t: -t[1])]
+
+
+def make_digest(content: str, headline: str = "", summary: str = "") -> str:
+    """Key sentences, figures and sentiment of an article as a few lines of text."""
+    text = content or summary or ""
+    if not text.strip():
+        return ""
+    lines = []
+    if summary and summary.strip() and summary.strip() not in text:
+        lines.append(f"Summary: {' '.join(summary.split())}")
+    lines.append("Key points: " + " ".join(key_sentences(text, headline)))
+    found = figures(text)
+    if found:
+        lines.append("Figures: " + ", ".join(found))
+    label, score = sentiment(f"{headline} {text}")
+    lines.append(f"Sentiment: {label} ({score:+d})")
+    return "\n".join(lines)
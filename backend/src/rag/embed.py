@@ -1,21 +1,35 @@
 import os
-import boto3
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 from dotenv import load_dotenv
+from ..metrics import traced
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
-AWS_SECRET_ACCESS_KEY = os.environ["AWS_SECRET_ACCESS_KEY"]
-AWS_ACCESS_KEY = os.environ["AWS_ACCESS_KEY"]
 region = "us-east-2"
+# Parallel Bedrock requests when embedding several texts at once.
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
 
-bedrock = boto3.client(
-    'bedrock-runtime',
-    region_name=region,
-    aws_access_key_id=AWS_ACCESS_KEY,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
+@cache
+def get_bedrock():
+    """
+    Bedrock runtime client, created on first use in each worker process.
+    BEDROCK_ENDPOINT_URL points it at another Bedrock-compatible endpoint (e.g. bench/fakes.py).
+    """
+    import boto3
 
+    return boto3.client(
+        'bedrock-runtime',
+        region_name=region,
+        endpoint_url=os.getenv("BEDROCK_ENDPOINT_URL"),
+        aws_access_key_id=os.environ["AWS_ACCESS_KEY"],
+        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"]
+    )
+
+@traced("embedding")
 def get_embedding(text: str) -> list[float]:
     """Fetches a 256-dimensional embedding from Amazon Bedrock's Titan Text Embeddings V2 model."""
 
@@ -27,7 +41,7 @@ def get_embedding(text: str) -> list[float]:
 
     try:
         # Invoke the model
-        response = bedrock.invoke_model(
+        response = get_bedrock().invoke_model(
             body=json.dumps(payload),
             contentType='application/json',
             modelId='amazon.titan-embed-text-v2:0'
@@ -35,32 +49,42 @@ def get_embedding(text: str) -> list[float]:
         
         result = json.loads(response['body'].read())
         embedding = result.get('embedding', None)
-        print("EMBEDDING:", embedding)
         if embedding is None:
             raise ValueError("Embedding not found in the response.")
 
         return embedding
 
-    except Exception as e:
-        print("error getting embedding: ", e)
+    except Exception:
+        logger.exception("error getting embedding")
         raise
-    
-from chonkie import RecursiveChunker, RecursiveRules, RecursiveLevel
 
+@traced("embedding_batch")
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Embed several texts concurrently, results are in the order of `texts`."""
+    if len(texts) <= 1:
+        return [get_embedding(t) for t in texts]
+    with ThreadPoolExecutor(max_workers=min(EMBED_CONCURRENCY, len(texts))) as pool:
+        return list(pool.map(get_embedding, texts))
+    
 CHAR_CHUNK_SIZE = 1500
-rules = RecursiveRules(
-    levels=[
-        RecursiveLevel(delimiters=["\n\n", "\n", "\r\n"]),
-        RecursiveLevel(delimiters=[".?!;:"]),
-        RecursiveLevel(),  # fallback
-    ]
-)
-chunker = RecursiveChunker(
-    tokenizer="character",
-    chunk_size=CHAR_CHUNK_SIZE,
-    rules=rules,
-    min_characters_per_chunk=24
-)
+
+@cache
+def get_chunker():
+    from chonkie import RecursiveChunker, RecursiveRules, RecursiveLevel
+
+    rules = RecursiveRules(
+        levels=[
+            RecursiveLevel(delimiters=["\n\n", "\n", "\r\n"]),
+            RecursiveLevel(delimiters=[".?!;:"]),
+            RecursiveLevel(),  # fallback
+        ]
+    )
+    return RecursiveChunker(
+        tokenizer="character",
+        chunk_size=CHAR_CHUNK_SIZE,
+        rules=rules,
+        min_characters_per_chunk=24
+    )
 
 def chunk_text(text: str):
     """
@@ -71,7 +95,7 @@ def chunk_text(text: str):
         "end": end_index
     }
     """
-    chunks = chunker(text)
+    chunks = get_chunker()(text)
     start_idx = 0
     chunk_info = []
 
@@ -0,0 +1,218 @@
+"""
+In-process mirror of the embeddings of recently queried ("hot") tickers.
+
+Each hot ticker keeps its embedding rows and a contiguous float32 matrix of their
+unit vectors, so a KNN search is one matrix-vector product instead of a Postgres
+round trip. Tickers are loaded on their first query and evicted least recently used.
+
+Commits are applied incrementally: inserted embeddings of hot tickers are loaded
+by id, deleted embeddings and articles are dropped from the mirror. That only sees
+commits made in this process, so every ticker is also reloaded after
+HOT_INDEX_TTL seconds to pick up writes from other workers.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from ..models import Article, Embedding, N_DIM, mentions
+from ..metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Number of tickers mirrored in memory per worker, 0 disables the mirror.
+HOT_INDEX_MAX_TICKERS = int(os.getenv("HOT_INDEX_MAX_TICKERS", "0"))
+# Seconds after which a mirrored ticker is reloaded from the database.
+HOT_INDEX_TTL = float(os.getenv("HOT_INDEX_TTL", "300"))
+
+HOT_INDEX_LOOKUPS = Counter("hot_index_lookups_total", "Ticker-scoped KNN searches by mirror outcome", ("result",))
+
+
+@dataclass
+class TickerIndex:
+    rows: list = field(default_factory=list)
+    ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    article_ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    matrix: np.ndarray = field(default_factory=lambda: np.empty((0, N_DIM), dtype=np.float32))
+    # publication time as epoch seconds, NaN when unknown
+    created: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.float64))
+    loaded_at: float = 0.0
+
+    @classmethod
+    def build(cls, rows: list, loaded_at: float) -> "TickerIndex":
+        if not rows:
+            return cls(loaded_at=loaded_at)
+        matrix = np.asarray([r.embedding for r in rows], dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return cls(
+            rows=list(rows),
+            ids=np.fromiter((r.id for r in rows), dtype=np.int64, count=len(rows)),
+            article_ids=np.fromiter((r.article_id for r in rows), dtype=np.int64, count=len(rows)),
+            matrix=np.ascontiguousarray(matrix),
+            created=np.array([r.created.timestamp() if r.created else np.nan for r in rows], dtype=np.float64),
+            loaded_at=loaded_at,
+        )
+
+    def with_rows(self, rows: list) -> "TickerIndex":
+        known = set(self.ids.tolist())
+        rows = [r for r in rows if r.id not in known]
+        if not rows:
+            return self
+        return TickerIndex.build(self.rows + rows, self.loaded_at)
+
+    def without(self, ids: set, article_ids: set) -> "TickerIndex":
+        drop = np.isin(self.ids, list(ids)) | np.isin(self.article_ids, list(article_ids))
+        if not drop.any():
+            return self
+        keep = np.flatnonzero(~drop)
+        return TickerIndex(
+            rows=[self.rows[i] for i in keep],
+            ids=self.ids[keep],
+            article_ids=self.article_ids[keep],
+            matrix=np.ascontiguousarray(self.matrix[keep]),
+            created=self.created[keep],
+            loaded_at=self.loaded_at,
+        )
+
+    def search(self, vector, max_results: int, since: datetime | None = None) -> list[tuple]:
+        """(row, cosine distance) of the `max_results` rows nearest to `vector` published at or after `since`, closest first."""
+        if not self.rows:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        distances = 1.0 - self.matrix @ query
+        if since is not None:
+            # NaN (undated) compares false, so undated rows are excluded like NULLs in SQL
+            distances[~(self.created >= since.timestamp())] = np.inf
+        k = min(max_results, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind="stable")]
+        return [(self.rows[i], float(distances[i])) for i in top if np.isfinite(distances[i])]
+
+
+class HotIndex:
+    """
+    LRU of TickerIndex objects. Readers use whatever TickerIndex is current; updates
+    build a new one and swap it in under the lock, so searches never block on writers.
+    """
+
+    def __init__(self, max_tickers: int = HOT_INDEX_MAX_TICKERS, ttl: float = HOT_INDEX_TTL, sessionmaker=None):
+        self.max_tickers = max_tickers
+        self.ttl = ttl
+        self._sessionmaker = sessionmaker
+        self._tickers: OrderedDict[str, TickerIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tickers > 0
+
+    def sessionmaker(self):
+        if self._sessionmaker is None:
+            from ..db import get_sessionmaker
+            self._sessionmaker = get_sessionmaker()
+        return self._sessionmaker
+
+    def _load_rows(self, where) -> list:
+        # A private session: the rows are detached when it closes and stay readable,
+        # with their article loaded by the relationship's selectin strategy.
+        with self.sessionmaker()() as db:
+            return db.execute(select(Embedding).where(where).order_by(Embedding.id)).scalars().all()
+
+    def load(self, ticker: str) -> TickerIndex:
+        started = time.monotonic()
+        index = TickerIndex.build(self._load_rows(mentions(Embedding, ticker)), started)
+        with self._lock:
+            self._tickers[ticker] = index
+            self._tickers.move_to_end(ticker)
+            while len(self._tickers) > self.max_tickers:
+                self._tickers.popitem(last=False)
+        logger.debug("hot index loaded %s: %d rows in %.1f ms", ticker, len(index.rows), 1000 * (time.monotonic() - started))
+        return index
+
+    def get(self, ticker: str) -> TickerIndex:
+        with self._lock:
+            index = self._tickers.get(ticker)
+            if index is not None:
+                self._tickers.move_to_end(ticker)
+        if index is not None and time.monotonic() - index.loaded_at < self.ttl:
+            HOT_INDEX_LOOKUPS.inc(result="hit")
+            return index
+        HOT_INDEX_LOOKUPS.inc(result="load" if index is None else "reload")
+        return self.load(ticker)
+
+    def search(self, ticker: str, vector, max_results: int, since: datetime | None = None) -> list[tuple]:
+        """(Embedding, cosine distance) of `ticker`'s rows nearest to `vector`, closest first."""
+        return self.get(ticker).search(vector, max_results, since)
+
+    def apply(self, added: dict, deleted_ids: set, deleted_article_ids: set):
+        """Mirror a commit: `added` maps new embedding ids to their symbols."""
+        with self._lock:
+            hot = set(self._tickers)
+        new_ids = [i for i, symbols in added.items() if hot.intersection(symbols)]
+        rows = self._load_rows(Embedding.id.in_(new_ids)) if new_ids else []
+
+        with self._lock:
+            for ticker, index in list(self._tickers.items()):
+                if deleted_ids or deleted_article_ids:
+                    index = index.without(deleted_ids, deleted_article_ids)
+                index = index.with_rows([r for r in rows if ticker in r.symbols])
+                self._tickers[ticker] = index
+
+    def clear(self):
+        with self._lock:
+            self._tickers.clear()
+
+
+HOT_INDEX = HotIndex()
+
+
+##############################################
+## Session hooks ##
+##############################################
+
+def _pending(session: Session) -> dict:
+    return session.info.setdefault("hot_index", {"added": {}, "deleted_ids": set(), "deleted_article_ids": set()})
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session: Session, flush_context):
+    if not HOT_INDEX.enabled:
+        return
+    pending = None
+    for obj in session.new:
+        if isinstance(obj, Embedding):
+            pending = pending or _pending(session)
+            pending["added"][obj.id] = tuple(obj.symbols or ())
+    for obj in session.deleted:
+        if isinstance(obj, Embedding):
+            pending = pending or _pending(session)
+            pending["deleted_ids"].add(obj.id)
+            pending["added"].pop(obj.id, None)
+        elif isinstance(obj, Article):
+            pending = pending or _pending(session)
+            pending["deleted_article_ids"].add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session: Session):
+    pending = session.info.pop("hot_index", None)
+    if pending and HOT_INDEX.enabled:
+        try:
+            HOT_INDEX.apply(pending["added"], pending["deleted_ids"], pending["deleted_article_ids"])
+        except Exception:
+            # the commit itself succeeded; fall back to reloading on the next query
+            logger.exception("hot index update failed, clearing it")
+            HOT_INDEX.clear()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changes(session: Session, previous_transaction):
+    session.info.pop("hot_index", None)
@@ -1,7 +1,37 @@
-from ..models import Embedding
-from sqlalchemy import select
+from ..models import Embedding, N_DIM, EMBEDDING_STORAGE, EMBEDDING_RERANK_FACTOR, mentions
+from sqlalchemy import select, cast, func, literal, text, values, column, true, Integer
+from sqlalchemy.orm import aliased
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
 import numpy as np
-from .embed import get_embedding
+import os
+import re
+from datetime import datetime, timezone, timedelta
+from .embed import get_embedding, get_embeddings
+from .rerank import mmr, collapse_duplicates, headline_key, url_key
+from .hot_index import HOT_INDEX
+from ..db import ARTICLE_PARTITIONING, get_engine
+from ..metrics import span
+from functools import cache
+
+HNSW_DEFAULT_EF_SEARCH = 40
+# Minimum ef_search of every search. pgvector's default of 40 finds about half of the
+# true top 10 on bench.vector_storage's corpus, 200 about 80% for ~0.5ms more per query.
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "200"))
+# ef_search of ticker- or date-filtered searches: HNSW applies the filter to the rows
+# it found, so a selective filter needs a wider scan to still return enough rows.
+HNSW_FILTERED_EF_SEARCH = int(os.getenv("HNSW_FILTERED_EF_SEARCH", "400"))
+# Relevance vs. diversity trade-off for MMR (1.0 = pure relevance).
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Candidates at least this cosine-similar to a better one are dropped as duplicates.
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.95"))
+# Time decay: up to RECENCY_WEIGHT is added to the cosine distance of older news when
+# ranking, half of it at RECENCY_HALF_LIFE_DAYS. 0 ranks by similarity only.
+RECENCY_WEIGHT = float(os.getenv("RECENCY_WEIGHT", "0.1"))
+RECENCY_HALF_LIFE_DAYS = float(os.getenv("RECENCY_HALF_LIFE_DAYS", "3"))
+# Searches without an explicit `since` only look at this many days of news (0: all).
+# With partitioned storage this prunes the KNN scan to the recent monthly partitions,
+# so it defaults to 90 days with ARTICLE_PARTITIONING=1.
+SEARCH_WINDOW_DAYS = int(os.getenv("SEARCH_WINDOW_DAYS", "90" if ARTICLE_PARTITIONING else "0"))
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     """Compute cosine similarity between two vectors, normalized 0..1."""
@@ -9,33 +39,204 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     b_norm = b / np.linalg.norm(b)
     return float(np.dot(a_norm, b_norm))  # 1 = identical, 0 = orthogonal
 
-def get_similar(text: str, db, max_results: int = 20, threshold: float = 0.2):
+def recency_penalty(created: datetime | None, now: datetime) -> float:
+    """Added to the cosine distance when ranking: 0 for news published now, RECENCY_WEIGHT for undated or very old news."""
+    if not RECENCY_WEIGHT:
+        return 0.0
+    if created is None:
+        return RECENCY_WEIGHT
+    age_days = max((now - created).total_seconds(), 0.0) / 86400
+    return RECENCY_WEIGHT * (1 - 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS))
+
+def rank_by_recency(hits: list[tuple]) -> list:
+    """(Embedding, distance) pairs sorted by distance plus recency penalty, Embeddings only."""
+    now = datetime.now(timezone.utc)
+    return [e for e, _ in sorted(hits, key=lambda h: h[1] + recency_penalty(h[0].created, now))]
+
+def default_since(since: datetime | None) -> datetime | None:
+    if since is None and SEARCH_WINDOW_DAYS:
+        return datetime.now(timezone.utc) - timedelta(days=SEARCH_WINDOW_DAYS)
+    return since
+
+def candidate_count(max_results: int, storage: str = EMBEDDING_STORAGE) -> int:
+    return max_results if storage == "vector" else max_results * EMBEDDING_RERANK_FACTOR
+
+@cache
+def pgvector_version() -> tuple[int, ...]:
+    with get_engine().connect() as conn:
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(p) for p in re.findall(r"\d+", version or ""))
+
+def set_ef_search(db, candidates: int, filtered: bool = False):
+    """
+    An HNSW scan returns at most ef_search rows, so raise it for large candidate sets;
+    it's at least HNSW_EF_SEARCH. Filtered searches get at least HNSW_FILTERED_EF_SEARCH,
+    and with pgvector >= 0.8 an iterative scan that keeps searching the graph until
+    enough rows pass the filter.
+    """
+    ef_search = max(candidates, HNSW_FILTERED_EF_SEARCH if filtered else HNSW_EF_SEARCH)
+    if ef_search > HNSW_DEFAULT_EF_SEARCH:
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    if filtered and pgvector_version() >= (0, 8):
+        # strict_order keeps results sorted by distance, callers stop at the threshold
+        db.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+
+def knn_statement(
+    query_vector, max_results: int, storage: str = EMBEDDING_STORAGE,
+    ticker: str | None = None, since: datetime | None = None,
+):
+    """
+    Select (Embedding, distance) rows closest to `query_vector` (a SQL expression of
+    type Vector) by cosine distance, optionally only chunks of articles mentioning
+    `ticker` or published at or after `since`. For quantized storage the matching index
+    expression picks the candidates and the full-precision column re-ranks them.
+    """
+    distance = Embedding.embedding.cosine_distance(query_vector)
+    stmt = select(Embedding, distance.label("distance"))
+    if ticker:
+        stmt = stmt.where(mentions(Embedding, ticker))
+    if since:
+        stmt = stmt.where(Embedding.created >= since)
+
+    if storage != "vector":
+        candidate = aliased(Embedding)
+        if storage == "halfvec":
+            approx = cast(candidate.embedding, HALFVEC(N_DIM)).cosine_distance(cast(query_vector, HALFVEC(N_DIM)))
+        else:
+            approx = cast(func.binary_quantize(candidate.embedding), BIT(N_DIM)).hamming_distance(
+                # a bound parameter is untyped, and binary_quantize is overloaded for vector and halfvec
+                cast(func.binary_quantize(cast(query_vector, Vector(N_DIM))), BIT(N_DIM))
+            )
+        candidates = select(candidate.id).order_by(approx).limit(candidate_count(max_results, storage))
+        if ticker:
+            candidates = candidates.where(mentions(candidate, ticker))
+        if since:
+            candidates = candidates.where(candidate.created >= since)
+        stmt = stmt.where(Embedding.id.in_(candidates))
+
+    return stmt.order_by(distance).limit(max_results)
+
+def get_similar(
+    text: str, db, max_results: int = 20, threshold: float = 0.2,
+    ticker: str | None = None, since: datetime | None = None,
+):
     """
     Return embeddings from the database similar to the given text.
-    Threshold: 0..1, minimum similarity (0.2 means >= 80% similar).
+    Threshold: 0..1, maximum cosine distance (0.2 means >= 80% similar).
+    With `ticker`, only chunks of articles mentioning it are searched, with `since`
+    only news published since then. Results are ranked with the recency penalty.
     """
     # Synchronous version of embedding
     vector = get_embedding(text)  # should return a list or numpy array
+    return similar_to_vector(vector, db, max_results, threshold, ticker, since)
 
-    # Step 1: order by cosine distance in SQL for index use
-    stmt = (
-        select(Embedding)
-        .order_by(Embedding.embedding.cosine_distance(vector))  # pgvector index
-        .limit(max_results)
-    )
+def similar_to_vector(
+    vector, db, max_results: int = 20, threshold: float = 0.2,
+    ticker: str | None = None, since: datetime | None = None,
+):
+    since = default_since(since)
+    if ticker and HOT_INDEX.enabled:
+        with span("knn.hot", max_results=max_results):
+            candidates = HOT_INDEX.search(ticker, vector, max_results, since)
+    else:
+        # Order by cosine distance in SQL for index use
+        stmt = knn_statement(literal(vector, Vector(N_DIM)), max_results, ticker=ticker, since=since)
 
-    candidates = db.scalars(stmt).all()  # synchronous fetch
+        with span("knn", max_results=max_results):
+            set_ef_search(db, candidate_count(max_results), filtered=bool(ticker or since))
+            candidates = db.execute(stmt).all()  # synchronous fetch
 
     results = []
-    min_similarity = 1.0 - threshold  # convert distance threshold to similarity
-
-    for r in candidates:
-        sim = cosine_similarity(np.array(r.embedding), np.array(vector))
-        print(r.article.content[r.start_ind:r.end_ind], sim)
-        if sim < min_similarity:
+    for r, distance in candidates:
+        if distance > threshold:
             break  # stop iterating, further items will be less similar
-        results.append(r)
+        results.append((r, distance))
+
+    return rank_by_recency(results)
+
+def diversify(query_vector, hits: list, max_results: int, per_article: int | None = None) -> list:
+    """
+    Pick `max_results` of the relevance-ordered `hits`: near-duplicates (by embedding,
+    or same headline/URL in another article) are collapsed, the rest is ordered by MMR,
+    and at most `per_article` chunks of one article are kept.
+    """
+    if not hits:
+        return []
+    vecs = np.asarray([h.embedding for h in hits], dtype=np.float32)
+    keys = [(headline_key(h.article.headline), url_key(h.article.url)) for h in hits]
+    kept = collapse_duplicates(vecs, keys, [h.article_id for h in hits], DUPLICATE_SIMILARITY)
+    now = datetime.now(timezone.utc)
+    penalty = np.array([recency_penalty(hits[i].created, now) for i in kept], dtype=np.float32)
+
+    selected = []
+    per_article_count = {}
+    for i in mmr(np.asarray(query_vector, dtype=np.float32), vecs[kept], len(kept), MMR_LAMBDA, penalty):
+        hit = hits[kept[i]]
+        if per_article and per_article_count.get(hit.article_id, 0) >= per_article:
+            continue
+        per_article_count[hit.article_id] = per_article_count.get(hit.article_id, 0) + 1
+        selected.append(hit)
+        if len(selected) == max_results:
+            break
+    return selected
+
+def get_diverse(
+    text: str, db, max_results: int = 5, threshold: float = 0.2,
+    candidates: int = 20, per_article: int | None = None,
+    ticker: str | None = None, since: datetime | None = None,
+):
+    """get_similar over `candidates` results, re-ranked down to `max_results` by diversify."""
+    vector = get_embedding(text)
+    hits = similar_to_vector(vector, db, max(candidates, max_results), threshold, ticker, since)
+    return diversify(vector, hits, max_results, per_article)
+
+def get_similar_many(
+    queries: list[str], db, max_results: int = 5, threshold: float = 0.2,
+    candidates: int | None = None, per_article: int | None = None,
+    ticker: str | None = None, since: datetime | None = None,
+) -> dict[str, list]:
+    """
+    Multi-query version of get_similar: embeds all queries concurrently and runs every
+    KNN search in one statement (LATERAL join over a VALUES list of query vectors).
+    Returns {query: [Embedding, ...]} where each embedding appears once, under the
+    query it is closest to. With `candidates`, that many rows are fetched per query
+    and re-ranked down to `max_results` by diversify. `ticker` and `since` filter as in
+    get_similar.
+    """
+    queries = list(dict.fromkeys(q for q in queries if q))
+    if not queries:
+        return {}
+    vectors = get_embeddings(queries)
+    fetch = max(candidates or max_results, max_results)
+    since = default_since(since)
+
+    if ticker and HOT_INDEX.enabled:
+        with span("knn.hot", max_results=fetch, queries=len(queries)):
+            # one snapshot of the ticker for all queries
+            index = HOT_INDEX.get(ticker)
+            rows = [(idx, e, distance) for idx, vector in enumerate(vectors) for e, distance in index.search(vector, fetch, since)]
+    else:
+        q = values(column("idx", Integer), column("vec", Vector(N_DIM)), name="q").data(list(enumerate(vectors)))
+        # VALUES parameters arrive untyped, cast so the distance operator and index apply
+        knn = knn_statement(cast(q.c.vec, Vector(N_DIM)), fetch, ticker=ticker, since=since).subquery().lateral("knn")
+        hit = aliased(Embedding, knn)
+        stmt = select(q.c.idx, hit, knn.c.distance).select_from(q).join(knn, true())
+
+        with span("knn", max_results=fetch, queries=len(queries)):
+            set_ef_search(db, candidate_count(fetch), filtered=bool(ticker or since))
+            rows = db.execute(stmt).all()
+
+    best = {}
+    for idx, e, distance in rows:
+        if distance <= threshold and (e.id not in best or distance < best[e.id][0]):
+            best[e.id] = (distance, idx, e)
 
+    results = {query: [] for query in queries}
+    for distance, idx, e in best.values():
+        results[queries[idx]].append((e, distance))
+    results = {query: rank_by_recency(hits) for query, hits in results.items()}
+    if candidates:
+        results = {q: diversify(v, results[q], max_results, per_article) for q, v in zip(queries, vectors)}
     return results
 
 
@@ -0,0 +1,76 @@
+"""
+Re-ranking of KNN candidates before they are put into a prompt: maximal marginal
+relevance (MMR) for diversity and near-duplicate collapse, so syndicated copies
+of one story or overlapping chunks don't fill several result slots.
+"""
+import re
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+def unit_rows(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(norms == 0, 1, norms)
+
+
+def mmr(query: np.ndarray, vecs: np.ndarray, k: int, lambda_: float = 0.7, penalty: np.ndarray | None = None) -> list[int]:
+    """
+    Indices of `k` rows of `vecs` in MMR order: each pick maximizes
+    lambda * (sim(query, v) - penalty) - (1 - lambda) * max(sim(v, already picked)).
+    """
+    vecs = unit_rows(vecs)
+    relevance = vecs @ unit_rows(query)
+    if penalty is not None:
+        relevance = relevance - penalty
+    n = len(vecs)
+    max_sim = np.zeros(n, dtype=np.float32)  # nothing picked yet, no redundancy penalty
+    available = np.ones(n, dtype=bool)
+    selected = []
+    for _ in range(min(k, n)):
+        scores = lambda_ * relevance - (1 - lambda_) * max_sim
+        scores[~available] = -np.inf
+        i = int(np.argmax(scores))
+        selected.append(i)
+        available[i] = False
+        max_sim = np.maximum(max_sim, vecs @ vecs[i])
+    return selected
+
+
+def headline_key(headline: str | None) -> str | None:
+    if not headline:
+        return None
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", headline.lower()).split()) or None
+
+
+def url_key(url: str | None) -> str | None:
+    if not url:
+        return None
+    parsed = urlparse(url.lower())
+    host = parsed.netloc.removeprefix("www.")
+    return f"{host}{parsed.path.rstrip('/')}" or None
+
+
+def collapse_duplicates(vecs: np.ndarray, keys: list[tuple], groups: list, threshold: float = 0.95) -> list[int]:
+    """
+    Indices to keep from relevance-ordered candidates. A candidate is dropped when its
+    embedding has cosine similarity >= threshold with a kept one, or when it shares a key
+    (normalized headline or URL) with a kept candidate from a different group (article).
+    """
+    if len(vecs) == 0:
+        return []
+    vecs = unit_rows(vecs)
+    sims = vecs @ vecs.T
+    kept = []
+    key_groups = {}
+    for i in range(len(vecs)):
+        if kept and sims[i, kept].max() >= threshold:
+            continue
+        if any(key_groups.get(k, groups[i]) != groups[i] for k in keys[i] if k):
+            continue
+        kept.append(i)
+        for k in keys[i]:
+            if k:
+                key_groups.setdefault(k, groups[i])
+    return kept
@@ -1,25 +1,39 @@
-import finnhub
 import os 
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional
-import httpx
 import asyncio
+import logging
+from functools import cache
 from dotenv import load_dotenv
+from .metrics import traced
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
-FIN_KEY = os.getenv("FINN_HUB")
-if not FIN_KEY:
-    raise ValueError("FINN_HUB environment variable not set")
+@cache
+def get_fin_client():
+    import finnhub
 
-fin_client = finnhub.Client(api_key=FIN_KEY)
+    fin_key = os.getenv("FINN_HUB")
+    if not fin_key:
+        raise ValueError("FINN_HUB environment variable not set")
+    client_cls = finnhub.Client
+    # FINNHUB_API_URL points the client at a local stand-in (see bench/fakes.py);
+    # the client builds URLs from the class attribute
+    api_url = os.getenv("FINNHUB_API_URL")
+    if api_url:
+        client_cls = type("Client", (finnhub.Client,), {"API_URL": api_url})
+    return client_cls(api_key=fin_key)
 
+@traced("fetch.profile")
 async def get_stock_data(ticker):
     """
     Asynchronously gathers a comprehensive set of stock data from Finnhub.
     """
     stock_data = {}
     try:
+        fin_client = get_fin_client()
+
         # Get company profile
         stock_data['company_profile'] = await asyncio.to_thread(fin_client.company_profile2, symbol=ticker)
     
@@ -39,14 +53,12 @@ async def get_stock_data(ticker):
             _from=three_months_ago.date().isoformat(),  # convert to date
             to=now.date().isoformat()
         )
-    except Exception as e:
-        print("Error in getting general stock data: ", e)
+    except Exception:
+        logger.exception("Error in getting general stock data for %s", ticker)
 
     return stock_data or {}
 
-ALPACA_KEY = os.environ["ALPACA_KEY"]
-ALPACA_SECRET = os.environ["ALPACA_SECRET"]
-
+@traced("fetch.news")
 async def fetch_ticker_news(
     ticker: str,
     limit: int = 50, # max
@@ -59,7 +71,7 @@ async def fetch_ticker_news(
     Fetches ticker-specific news via Alpaca's News API.
     Returns parsed JSON with metadata and content.
     """
-    url = "https://data.alpaca.markets/v1beta1/news"
+    url = os.getenv("ALPACA_NEWS_URL", "https://data.alpaca.markets/v1beta1/news")
 
     params = {
         "symbols": ticker,
@@ -73,17 +85,19 @@ async def fetch_ticker_news(
         params["start"] = published_from  
 
     headers = {
-        "APCA-API-KEY-ID": ALPACA_KEY,
-        "APCA-API-SECRET-KEY": ALPACA_SECRET,
+        "APCA-API-KEY-ID": os.environ["ALPACA_KEY"],
+        "APCA-API-SECRET-KEY": os.environ["ALPACA_SECRET"],
         "Accept": "application/json"
     }
     try:
+        import httpx
+
         async with httpx.AsyncClient() as client:
             response = await client.get(url, headers=headers, params=params)
             response.raise_for_status()
             response = response.json()
             return response.get("news", [])
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Error fetching news for %s", ticker)
         return []
 
@@ -0,0 +1,249 @@
+"""
+Corpus snapshots: the ticker, fundamentals (recommendation_trend,
+earnings_surprise, insider_sentiment), article, ticker_article and embedding
+tables as Parquet files, to bootstrap a new database without fetching and
+embedding every ticker's news again.
+
+    python -m src.maintenance export-snapshot snapshots/2025-01
+    python -m src.maintenance import-snapshot snapshots/2025-01
+
+A snapshot is a directory with one Parquet file per table and a manifest. Vectors
+are stored as fixed-size float32 lists. The importer only loads into empty tables:
+it drops the secondary indexes, COPYs every table in one transaction (ids are
+kept, sequences are moved past them), then builds the indexes once, HNSW last,
+with INDEX_BUILD_WORKERS parallel maintenance workers.
+
+Needs pyarrow (the `snapshot` extra: `uv sync --extra snapshot`), which the app itself doesn't.
+"""
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import ARRAY, JSON, Boolean, Date, DateTime, Float, Integer, select, text
+
+from .db import create_all_tables, create_extensions, create_partitions, get_engine, is_partitioned
+from .models import (
+    N_DIM, Article, EarningsSurprise, Embedding, InsiderSentiment, RecommendationTrend, Ticker, ticker_article,
+)
+
+logger = logging.getLogger(__name__)
+
+# Parallel maintenance workers and memory for the index builds after an import.
+INDEX_BUILD_WORKERS = int(os.getenv("INDEX_BUILD_WORKERS", "4"))
+INDEX_BUILD_MEMORY = os.getenv("INDEX_BUILD_MEMORY", "1GB")
+
+SNAPSHOT_VERSION = 1
+BATCH_ROWS = 5000
+# In load order, so foreign keys are satisfied.
+TABLES = {
+    "ticker": Ticker.__table__,
+    # ticker.last_updated comes along, so collect_data won't refresh these for a while
+    "recommendation_trend": RecommendationTrend.__table__,
+    "earnings_surprise": EarningsSurprise.__table__,
+    "insider_sentiment": InsiderSentiment.__table__,
+    "article": Article.__table__,
+    "ticker_article": ticker_article,
+    "embedding": Embedding.__table__,
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("snapshots need pyarrow: uv sync --extra snapshot (or pip install pyarrow)") from e
+    return pyarrow
+
+
+def arrow_type(pa, column):
+    t = column.type
+    if isinstance(t, Vector):
+        return pa.list_(pa.float32(), N_DIM)
+    if isinstance(t, ARRAY):
+        return pa.list_(pa.string())  # JSON items are stored encoded
+    if isinstance(t, JSON):
+        return pa.string()
+    if isinstance(t, Boolean):
+        return pa.bool_()
+    if isinstance(t, Integer):
+        return pa.int64()
+    if isinstance(t, Float):
+        return pa.float64()
+    if isinstance(t, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(t, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _to_arrow(pa, column, values: list):
+    t = column.type
+    if isinstance(t, Vector):
+        import numpy as np
+
+        flat = np.asarray(values, dtype=np.float32).reshape(-1)
+        return pa.FixedSizeListArray.from_arrays(pa.array(flat, pa.float32()), N_DIM)
+    if isinstance(t, ARRAY) and isinstance(t.item_type, JSON):
+        values = [None if v is None else [json.dumps(i) for i in v] for v in values]
+    elif isinstance(t, JSON):
+        values = [None if v is None else json.dumps(v) for v in values]
+    return pa.array(values, arrow_type(pa, column))
+
+
+def export_snapshot(path: str) -> dict:
+    """Write the corpus tables to `path` (a directory), returns rows per table."""
+    pa = _pyarrow()
+    directory = Path(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    rows = {}
+    # one repeatable-read transaction, so the tables are consistent with each other
+    with get_engine().connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        for name, table in TABLES.items():
+            columns = list(table.columns)
+            schema = pa.schema([pa.field(c.name, arrow_type(pa, c), nullable=bool(c.nullable)) for c in columns])
+            result = conn.execution_options(stream_results=True, yield_per=BATCH_ROWS).execute(select(table))
+            rows[name] = 0
+            with pa.parquet.ParquetWriter(directory / f"{name}.parquet", schema, compression="zstd") as writer:
+                for batch in result.partitions():
+                    arrays = [_to_arrow(pa, c, [r[i] for r in batch]) for i, c in enumerate(columns)]
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+                    rows[name] += len(batch)
+            logger.info("exported %d %s rows", rows[name], name)
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "n_dim": N_DIM,
+        "tables": rows,
+    }
+    (directory / "manifest.json").write_text(json.dumps(manifest, indent=2) + "\n")
+    return rows
+
+
+##############################################
+## Import ##
+##############################################
+
+def _escape(value: str) -> str:
+    """COPY text format escaping."""
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _array_literal(items: list) -> str:
+    quoted = ('NULL' if i is None else '"' + i.replace("\\", "\\\\").replace('"', '\\"') + '"' for i in items)
+    return "{" + ",".join(quoted) + "}"
+
+
+def _copy_column(pa, field, array) -> list[str]:
+    """One column of a record batch as COPY text fields."""
+    if pa.types.is_fixed_size_list(field.type):
+        matrix = array.values.to_numpy(zero_copy_only=False).reshape(-1, field.type.list_size)
+        # 9 significant digits round-trip float32 exactly
+        return ["[" + ",".join(f"{x:.9g}" for x in row) + "]" for row in matrix.tolist()]
+    values = array.to_pylist()
+    if pa.types.is_list(field.type):
+        return ["\\N" if v is None else _escape(_array_literal(v)) for v in values]
+    if pa.types.is_boolean(field.type):
+        return ["\\N" if v is None else ("t" if v else "f") for v in values]
+    if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+        return ["\\N" if v is None else v.isoformat() for v in values]
+    if pa.types.is_string(field.type):
+        return ["\\N" if v is None else _escape(v) for v in values]
+    return ["\\N" if v is None else str(v) for v in values]
+
+
+def deferrable_indexes(conn) -> list[tuple[str, str]]:
+    """(name, definition) of the corpus tables' indexes that don't back a constraint, HNSW last."""
+    rows = conn.execute(
+        text(
+            """
+            SELECT i.relname, pg_get_indexdef(i.oid), am.amname
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_class t ON t.oid = x.indrelid
+            JOIN pg_am am ON am.oid = i.relam
+            WHERE t.relname = ANY(:tables) AND t.relnamespace = 'public'::regnamespace
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.oid)
+            ORDER BY am.amname = 'hnsw', i.relname
+            """
+        ),
+        {"tables": list(TABLES)},
+    ).all()
+    # the definition of an index on a partitioned table reads "ON ONLY", which wouldn't cascade to partitions
+    return [(name, ddl.replace(" ON ONLY ", " ON ")) for name, ddl, _ in rows]
+
+
+def import_snapshot(
+    path: str, workers: int | None = None, memory: str | None = None, defer_indexes: bool = True,
+) -> dict:
+    """
+    Load the snapshot at `path` into empty corpus tables, creating them if needed.
+    With `defer_indexes` the secondary indexes are dropped before loading and built
+    afterwards with `workers` parallel workers and `memory` of maintenance_work_mem
+    (default INDEX_BUILD_WORKERS and INDEX_BUILD_MEMORY). Returns rows per table and timings.
+    """
+    workers = INDEX_BUILD_WORKERS if workers is None else workers
+    memory = memory or INDEX_BUILD_MEMORY
+    pa = _pyarrow()
+    directory = Path(path)
+    manifest = json.loads((directory / "manifest.json").read_text())
+    if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("n_dim") != N_DIM:
+        raise ValueError(f"snapshot {path} has version {manifest.get('version')} and {manifest.get('n_dim')} dimensions, "
+                         f"expected version {SNAPSHOT_VERSION} with {N_DIM}")
+
+    create_extensions()
+    create_all_tables()
+    with get_engine().begin() as conn:
+        if conn.execute(text("SELECT EXISTS (SELECT 1 FROM ticker) OR EXISTS (SELECT 1 FROM article)")).scalar():
+            raise RuntimeError("snapshots can only be imported into an empty database")
+        if is_partitioned(conn):
+            created = pa.parquet.read_table(directory / "article.parquet", columns=["created"]).column("created")
+            if len(created):
+                bounds = pa.compute.min_max(created).as_py()
+                create_partitions(conn, bounds["min"], bounds["max"])
+        indexes = deferrable_indexes(conn) if defer_indexes else []
+
+    stats = {"rows": {}, "indexes": {}}
+    raw = get_engine().raw_connection()
+    try:
+        with raw.cursor() as cur:
+            started = time.perf_counter()
+            for name, _ in indexes:
+                cur.execute(f'DROP INDEX "{name}"')
+            for name in TABLES:
+                parquet = pa.parquet.ParquetFile(directory / f"{name}.parquet")
+                columns = ", ".join(f'"{f.name}"' for f in parquet.schema_arrow)
+                stats["rows"][name] = 0
+                for batch in parquet.iter_batches(batch_size=BATCH_ROWS):
+                    fields = [_copy_column(pa, f, batch.column(i)) for i, f in enumerate(batch.schema)]
+                    buf = io.StringIO("".join("\t".join(row) + "\n" for row in zip(*fields)))
+                    cur.copy_expert(f"COPY {name} ({columns}) FROM STDIN", buf)
+                    stats["rows"][name] += batch.num_rows
+                logger.info("loaded %d %s rows", stats["rows"][name], name)
+            for name in ("ticker", "article", "embedding"):
+                cur.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE((SELECT max(id) FROM {name}), 0) + 1, false)"
+                )
+            raw.commit()
+            stats["load_seconds"] = round(time.perf_counter() - started, 3)
+
+            for name in TABLES:
+                cur.execute(f"ANALYZE {name}")
+            cur.execute("SET maintenance_work_mem = %s", (memory,))
+            cur.execute("SET max_parallel_maintenance_workers = %s", (workers,))
+            for name, ddl in indexes:
+                started = time.perf_counter()
+                cur.execute(ddl)
+                raw.commit()
+                stats["indexes"][name] = round(time.perf_counter() - started, 3)
+                logger.info("built index %s in %.1fs", name, stats["indexes"][name])
+        raw.commit()
+    finally:
+        raw.close()
+    return stats